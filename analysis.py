@@ -0,0 +1,184 @@
+
+"""
+Static analysis of lexer trees
+
+Lengths are None when unbounded
+"""
+import lexer
+import parser
+
+QUANTIFIERS = ("KLEENE", "LAZY_KLEENE", "MATCH",
+               "LAZY_MATCH", "OPT", "LAZY_OPT")
+LOOKAROUNDS = ("LOOKAHEAD", "LOOKAHEAD_NEG", "LOOKBEHIND", "LOOKBEHIND_NEG")
+
+
+def _add(a, b):
+    return None if a is None or b is None else a + b
+
+
+def _max(a, b):
+    return None if a is None or b is None else max(a, b)
+
+
+def max_len(tree):
+    """
+    Returns the max length of a match of the tree
+    """
+    if tree is None or type(tree) is not tuple:
+        return 0
+    k = tree[0]
+    if k == "UNION_EXPR":
+        res = 0
+        for kid in tree[1]:
+            res = _max(res, max_len(kid))
+        return res
+    elif k == "ANCHORED_EXPR":
+        return max_len(tree[2])
+    elif k == "CONCAT_EXPR":
+        res = 0
+        for kid in tree[1]:
+            res = _add(res, max_len(kid))
+        return res
+    elif k == "EXPR":
+        if tree[1][0] in ("EXTENDED_CHAR", "CHAR_CLASS"):
+            return 1
+        return max_len(tree[1])
+    elif k in LOOKAROUNDS:
+        return 0
+    elif k in QUANTIFIERS:
+        res = max_len(tree[1])
+        if k.endswith("OPT") or res == 0:
+            return res
+        return None
+    elif type(k) is tuple and k[0] == "RANGE":
+        res = max_len(tree[1])
+        v = k[1]
+        if v[0] == "N,":
+            return 0 if res == 0 else None
+        # the upper bound is the last number for {n}, {,n} and {n,m}
+        return None if res is None else res * v[-1]
+    raise SyntaxError(f"unknown expression {k}")
+
+
+def reach(tree):
+    """
+    Returns how far (behind, ahead) of a match of the tree its guards may read the input
+    """
+    if tree is None or type(tree) is not tuple:
+        return (0, 0)
+    k = tree[0]
+    if k in LOOKAROUNDS:
+        body = tree[1]
+        if k.startswith("LOOKBEHIND"):
+            # the lookbehind expr is inverted by the lexer
+            body = lexer.reverse(body)
+        behind, ahead = reach(body)
+        if k.startswith("LOOKAHEAD"):
+            return (behind, _add(max_len(body), ahead))
+        return (_add(max_len(body), behind), ahead)
+
+    behind, ahead = (0, 0)
+    if k in ("EXTENDED_CHAR", "CHAR_CLASS"):
+        return (0, 0)
+    elif k == "ANCHORED_EXPR":
+        # anchors read the char before (resp. after) them
+        if '^' in tree[1]:
+            behind = 1
+        if '$' in tree[1]:
+            ahead = 1
+        kids = (tree[2],)
+    elif k in ("UNION_EXPR", "CONCAT_EXPR"):
+        kids = tree[1]
+    else:
+        kids = tree[1:]
+    for kid in kids:
+        b, a = reach(kid)
+        behind, ahead = _max(behind, b), _max(ahead, a)
+    return (behind, ahead)
+
+
+def required_literals(tree):
+    """
+    Returns a (literals, lead) pair such that every non-empty match of the tree contains one of the literals,
+    starting at most lead chars (None if unbounded) after the start of the match,
+    or None if there are no such literals
+    """
+    exact, required = _literals(tree)
+    if exact:
+        return ((exact,), 0)
+    if not required:
+        return None
+    # prefer long literals, then fewer of them, then ones close to the start of the match
+    return max(required, key=lambda r: (min(map(len, r[0])), -len(r[0]), r[1] is not None, -(r[1] or 0)))
+
+
+# returns (exact, required) for a tree, with exact the only string the tree matches (None if it matches others),
+# and required a list of (literals, lead) as per required_literals
+def _literals(tree):
+    if tree is None or type(tree) is not tuple:
+        return ("", [])
+    k = tree[0]
+    if k == "UNION_EXPR":
+        if len(tree[1]) == 1:
+            return _literals(tree[1][0])
+        alts = set(_literals(kid)[0] for kid in tree[1])
+        if None in alts or "" in alts:
+            return (None, [])
+        if len(alts) == 1:
+            return (alts.pop(), [])
+        # one of the alternatives is required
+        return (None, [(tuple(sorted(alts)), 0)])
+    elif k == "ANCHORED_EXPR":
+        # anchors are zero-width
+        return _literals(tree[2])
+    elif k == "CONCAT_EXPR":
+        exact = True
+        required = []
+        # the run of exact kids so far, and its lead
+        run, run_lead = "", 0
+        lead = 0
+        for kid in tree[1]:
+            e, r = _literals(kid)
+            if e is not None:
+                if not run:
+                    run_lead = lead
+                run += e
+            else:
+                exact = False
+                if run:
+                    required.append(((run,), run_lead))
+                    run = ""
+                required.extend((lits, _add(lead, l)) for lits, l in r)
+            lead = _add(lead, max_len(kid))
+        if exact:
+            return (run, [])
+        if run:
+            required.append(((run,), run_lead))
+        return (None, required)
+    elif k == "EXPR":
+        kid = tree[1]
+        if kid[0] == "EXTENDED_CHAR":
+            return (parser.extended_char(kid[1]).single(), [])
+        elif kid[0] == "CHAR_CLASS":
+            return (parser.char_class(kid[1]).single(), [])
+        return _literals(kid)
+    elif k in LOOKAROUNDS:
+        # lookarounds are zero-width, what they look for isn't part of the match
+        return ("", [])
+    elif k in QUANTIFIERS:
+        if k.endswith("MATCH"):
+            # the first repetition is required
+            e, r = _literals(tree[1])
+            return (None, r + [((e,), 0)] if e else r)
+        return (None, [])
+    elif type(k) is tuple and k[0] == "RANGE":
+        v = k[1]
+        n = 0 if v[0] == ",N" else v[1]
+        if n == 0:
+            return (None, [])
+        # the first n repetitions are required
+        e, r = _literals(tree[1])
+        if e is not None and v[0] == "N":
+            return (e * n, [])
+        return (None, r + [((e * n,), 0)] if e else r)
+    raise SyntaxError(f"unknown expression {k}")
@@ -0,0 +1,339 @@
+
+"""
+Benchmarks for compile time, scan throughput and pathological patterns
+
+Usage: python bench.py [--quick] [--filter TEXT] [--repeat N] [--json FILE] [--baseline FILE] [--save-baseline] [--threshold RATIO]
+
+Every benchmark is timed as the best of a few runs (more for short ones), over inputs generated from a fixed seed.
+Where the stdlib's re finds the same matches, it's timed too, for comparison.
+Results can be written as JSON, and are checked against a baseline (bench_baseline.json by default):
+timings are scaled by those of a calibration loop, so that a baseline carries over between machines,
+and the exit status is 1 if any benchmark got slower than its baseline by more than the threshold
+(those that do are run again first, and only count if they stay slower).
+The loop is timed in between the runs of every benchmark, which is scaled by the loop's best time there,
+so that a machine getting faster or slower during the run (as shared ones do) doesn't skew the comparison
+"""
+from timeit import default_timer as timer
+from collections import namedtuple
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import statistics
+import sys
+import regex
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# benchmarks slower than their baseline by more than this ratio are regressions
+DEFAULT_THRESHOLD = 0.25
+# the seed inputs are generated from
+SEED = 1234
+# runs of the calibration loop by calibrate()
+CALIBRATION_RUNS = 5
+# seconds of runs of a benchmark the calibration loop is run again after
+CALIBRATION_EVERY = 0.05
+# number of times the benchmarks that look slower than their baseline are run again
+RETRIES = 2
+# time short benchmarks are run for at least, in all
+MIN_SECONDS = 1
+
+# a benchmark: run() is timed, and so is run_re() if given and it returns the same as run().
+# size is the number of bytes run() scans, for throughput, None if it doesn't
+Bench = namedtuple("Bench", ["group", "name", "run", "run_re", "size"])
+
+
+def benchmarks(quick=False):
+    """
+    Returns the list of benchmarks, run over smaller inputs if quick
+    """
+    scale = 1 if quick else 4
+    rng = random.Random(SEED)
+    res = []
+
+    # compile time, for growing alternations and range quantifier bounds
+    words = sorted({"".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(3, 10)))
+                    for _ in range(1000 * scale)})
+    for n in (10, 100, 1000 * scale):
+        res.append(_compile("alternation", f"{n} words", "|".join(words[:n])))
+    for n in (10, 100, 1000):
+        res.append(_compile("range", f"a{{1,{n}}}", f"a{{1,{n}}}"))
+        res.append(_compile("range", f"(ab|cd){{{n // 10},{n}}}", f"(ab|cd){{{n // 10},{n}}}"))
+
+    # scan throughput, over synthetic logs
+    log = _log(rng, 2000 * scale)
+    for name, pattern, re_pattern in (
+            ("literal", "ERROR", "ERROR"),
+            ("alternation", "GET|POST|PUT|DELETE", "GET|POST|PUT|DELETE"),
+            ("ipv4", r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}", r"[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}"),
+            ("timestamp", r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d", r"[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}"),
+            ("email", r"[a-z0-9]+@[a-z]+\.com", r"[a-z0-9]+@[a-z]+\.com"),
+            ("line end", r"[0-9]+ms$", r"[0-9]+ms$")):
+        res.append(_scan("scan", name, pattern, re_pattern, log))
+    res.append(_scan("scan", "ipv4 (bytes)", r"\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}",
+                     rb"[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}", log.encode()))
+    ids = [f"{rng.getrandbits(32):08x}-{rng.getrandbits(16):04x}" + ("" if rng.random() < 0.9 else "!")
+           for _ in range(5000 * scale)]
+    res.append(_batch("batch", "fullmatch_many ids", r"[0-9a-f]{8}-[0-9a-f]{4}", ids))
+    res.append(_validate("batch", "fullmatch ids (eager)", r"[0-9a-f]{8}-[0-9a-f]{4}", ids))
+
+    # the REPL's showcase pattern (lookarounds of variable length, which re doesn't support)
+    showcase = "[[[h7lolahehello\n +++ \nabcdefghi abcdef 3.14 -2e10 .5E-3 ghi\n" * (20 * scale)
+    res.append(_scan("showcase", "default pattern", regex.DEFAULT_PATTERN, None, showcase))
+
+    # known worst cases
+    abc = "abc" * (2000 * scale)
+    res.append(_scan("worst", "lookarounds", r"(?<=a)b(?=c)", r"(?<=a)b(?=c)", abc))
+    res.append(_scan("worst", "unbounded lookbehind", r"(?<=x\w*)c", None, "x" + abc))
+    # re backtracks exponentially on these (which have no literal to prefilter on)
+    res.append(_scan("worst", "nested quantifiers", r"(a*)*[^a]", None, "a" * (2000 * scale)))
+    res.append(_scan("worst", "nested alternation", r"(a|aa)+[^a]", None, "a" * (2000 * scale)))
+    # every pair of positions is a match
+    res.append(_scan("worst", "all pairs", r"a+", None, "a" * (100 * scale), overlapped=True))
+    return res
+
+
+# returns the benchmark of compiling a pattern
+def _compile(group, name, pattern):
+    def run():
+        # not regex.compile, which caches
+        regex.Regex(pattern)
+
+    def run_re():
+        re.purge()
+        re.compile(pattern)
+    return Bench(group, name, run, run_re, None)
+
+
+# returns the benchmark of scanning an input for a pattern, as regex.scan does,
+# against re's matches for re_pattern if given
+def _scan(group, name, pattern, re_pattern, input, overlapped=False):
+    binary = isinstance(input, bytes)
+    reg = regex.Regex(pattern, binary=binary)
+    run_re = None
+    if re_pattern is not None:
+        compiled = re.compile(re_pattern, re.MULTILINE)
+
+        def run_re():
+            return [m.span() for m in compiled.finditer(input) if m.end() > m.start()]
+    size = len(input) if binary else len(input.encode("utf-8"))
+    return Bench(group, name, lambda: reg.scan(input, overlapped=overlapped), run_re, size)
+
+
+# returns the benchmark of matching many inputs as a whole, as Regex.fullmatch_many does
+# with the pattern compiled eagerly, so that it's run through a dense DFA table if NumPy is installed
+def _batch(group, name, pattern, inputs):
+    reg = regex.Regex(pattern, eager=True)
+    compiled = re.compile(pattern)
+
+    def run_re():
+        return [(k, 0, len(input)) for k, input in enumerate(inputs) if compiled.fullmatch(input)]
+    size = sum(len(input) for input in inputs)
+    return Bench(group, name, lambda: reg.fullmatch_many(inputs), run_re, size)
+
+
+# returns the benchmark of validating inputs one at a time, as Regex.fullmatch does
+# with the pattern compiled eagerly into a minimal DFA
+def _validate(group, name, pattern, inputs):
+    reg = regex.Regex(pattern, eager=True)
+    compiled = re.compile(pattern)
+
+    def run():
+        return [k for k, input in enumerate(inputs) if reg.fullmatch(input)]
+
+    def run_re():
+        return [k for k, input in enumerate(inputs) if compiled.fullmatch(input)]
+    size = sum(len(input) for input in inputs)
+    return Bench(group, name, run, run_re, size)
+
+
+# returns lines of synthetic web server logs
+def _log(rng, lines):
+    res = []
+    for _ in range(lines):
+        res.append(f"2024-{rng.randint(1, 12):02}-{rng.randint(1, 28):02} "
+                   f"{rng.randint(0, 23):02}:{rng.randint(0, 59):02}:{rng.randint(0, 59):02} "
+                   f"{rng.choice(('INFO', 'INFO', 'INFO', 'WARN', 'ERROR'))} "
+                   f"user{rng.randint(1, 999)}@{rng.choice(('example', 'mail', 'corp'))}.com "
+                   f"{rng.choice(('GET', 'POST', 'PUT', 'DELETE'))} /api/v{rng.randint(1, 3)}/items?id={rng.randint(1, 99999)} "
+                   f"from {rng.randint(1, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)} "
+                   f"in {rng.randint(1, 999)}ms")
+    return "\n".join(res)
+
+
+# returns the best time of a few runs of fn, its result and the best time of the calibration loop
+# run in between: run repeat times at least, and for MIN_SECONDS in all, so that short benchmarks
+# get enough runs for the best one to be steady. The loop is run before, after,
+# and every CALIBRATION_EVERY seconds of runs, so that it's timed while the machine is as fast as for fn
+def _time(fn, repeat):
+    best = None
+    units = _calibration_times(1)
+    total = 0
+    runs = 0
+    since = 0
+    while runs < repeat or total < MIN_SECONDS:
+        start = timer()
+        res = fn()
+        elapsed = timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+        total += elapsed
+        runs += 1
+        since += elapsed
+        if since >= CALIBRATION_EVERY:
+            units += _calibration_times(1)
+            since = 0
+    if since:
+        units += _calibration_times(1)
+    return best, res, min(units)
+
+
+def calibrate(runs=CALIBRATION_RUNS):
+    """
+    Returns the median time taken by a fixed pure-Python loop over the given number of runs,
+    the unit benchmarks are compared in between machines
+    """
+    return statistics.median(_calibration_times(runs))
+
+
+# returns the times taken by each of the given number of runs of the calibration loop
+def _calibration_times(runs):
+    def loop():
+        d = {}
+        for i in range(200000):
+            d[i & 1023] = d.get(i & 1023, 0) + i
+        return d
+    res = []
+    for _ in range(runs):
+        start = timer()
+        loop()
+        res.append(timer() - start)
+    return res
+
+
+def run(benches, repeat=3, out=sys.stdout):
+    """
+    Runs the benchmarks, printing a line per benchmark, and returns their results by name
+    """
+    results = {}
+    for bench in benches:
+        name = f"{bench.group}: {bench.name}"
+        seconds, res, unit = _time(bench.run, repeat)
+        result = {"seconds": seconds, "calibration": unit}
+        if bench.size is not None:
+            result["mb_s"] = bench.size / seconds / 1e6
+        if bench.run_re is not None:
+            re_seconds, re_res, _ = _time(bench.run_re, repeat)
+            # only comparable if both find the same matches
+            if res == re_res:
+                result["re_seconds"] = re_seconds
+        results[name] = result
+        print(_format(name, result), file=out)
+    return results
+
+
+def _format(name, result):
+    line = f"{name:<40} {result['seconds'] * 1000:>10.2f} ms"
+    if "mb_s" in result:
+        line += f" {result['mb_s']:>8.2f} MB/s"
+    if "re_seconds" in result:
+        line += f"   re: {result['re_seconds'] * 1000:.2f} ms ({result['seconds'] / result['re_seconds']:.1f}x)"
+    return line
+
+
+def regressions(results, calibration, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns the benchmarks slower than in the baseline by more than the threshold,
+    as a list of (name, seconds, baseline seconds scaled to this machine).
+    Each benchmark is scaled by the calibration timed along with it, if both it and its baseline have one,
+    else by those of the whole runs
+    """
+    res = []
+    for name, result in results.items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        if "calibration" in result and "calibration" in base:
+            scale = result["calibration"] / base["calibration"]
+        else:
+            scale = calibration / baseline["calibration"]
+        expected = base["seconds"] * scale
+        if result["seconds"] > expected * (1 + threshold):
+            res.append((name, result["seconds"], expected))
+    return res
+
+
+def main(argv=None):
+    """
+    Runs the benchmarks, returns the exit status: 1 if any regressed against the baseline, else 0
+    """
+    argparser = argparse.ArgumentParser(description="Run the benchmarks")
+    argparser.add_argument("--quick", action="store_true",
+                           help="run over smaller inputs")
+    argparser.add_argument("--filter", default="",
+                           help="only run benchmarks whose name contains this")
+    argparser.add_argument("--repeat", type=int, default=3,
+                           help="least number of runs each benchmark is timed over (the best one counts)")
+    argparser.add_argument("--json", help="write the results to this file")
+    argparser.add_argument("--baseline", default=BASELINE,
+                           help="baseline to check the results against")
+    argparser.add_argument("--save-baseline", action="store_true",
+                           help="save the results as the baseline instead")
+    argparser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                           help="slowdown ratio over the baseline counted as a regression")
+    args = argparser.parse_args(argv)
+
+    benches = [bench for bench in benchmarks(args.quick)
+               if args.filter in f"{bench.group}: {bench.name}"]
+    results = run(benches, args.repeat)
+    calibration = statistics.median(result["calibration"] for result in results.values()) if results else calibrate()
+    report = {
+        "python": platform.python_version(),
+        "quick": args.quick,
+        "calibration": calibration,
+        "results": results,
+    }
+    if args.save_baseline:
+        _write(report, args.json)
+        _write(report, args.baseline)
+        return 0
+
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["quick"] != args.quick:
+            print("baseline was run with" + ("" if baseline["quick"] else "out") +
+                  " --quick, not comparing", file=sys.stderr)
+            baseline = None
+    slower = []
+    if baseline is not None:
+        slower = regressions(results, calibration, baseline, args.threshold)
+        # the machine may just have been busy: those that look slower are run again,
+        # their best run counting, so that only those that stay slower are regressions
+        for _ in range(RETRIES):
+            if not slower:
+                break
+            names = {name for name, _, _ in slower}
+            print(f"running {len(names)} benchmark(s) again", file=sys.stderr)
+            again = run([bench for bench in benches if f"{bench.group}: {bench.name}" in names], args.repeat)
+            for name, result in again.items():
+                if result["seconds"] / result["calibration"] < results[name]["seconds"] / results[name]["calibration"]:
+                    results[name] = result
+            slower = regressions(results, calibration, baseline, args.threshold)
+    _write(report, args.json)
+    for name, seconds, expected in slower:
+        print(f"REGRESSION {name}: {seconds * 1000:.2f} ms, expected {expected * 1000:.2f} ms", file=sys.stderr)
+    return 1 if slower else 0
+
+
+# writes the report as JSON to the given file, if any
+def _write(report, path):
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
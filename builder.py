@@ -0,0 +1,235 @@
+
+"""
+Construction of automata in a single arena, as the parser builds them (see parser.parse)
+
+Rather than building a new automaton out of the automata of its operands for every op,
+which would copy the whole automaton again at each level of nesting, a Builder
+appends states and transitions to flat lists, shared by every subexpression of a pattern:
+subexpressions are fragments of the arena, which ops link together by adding a few states
+and empty transitions, without copying anything. States are plain ints, so that the arena
+is turned into a Program (see freeze) without renaming them either.
+
+Building an automaton this way takes time linear in its size
+"""
+from collections import namedtuple
+from optimize import optimize
+from program import Program, State
+
+# a part of the arena matching a subexpression, entered at its start state and left from its end state.
+# Its states are those numbered from lo (included) to hi (excluded), transitions only linking them together
+Fragment = namedtuple("Fragment", ["start", "end", "lo", "hi"])
+
+
+class Builder:
+    """
+    An arena of states and transitions, which fragments are built in (see Fragment)
+
+    Ops return new fragments made of the ones they're given, which mustn't be used again
+    (but for being copied first, see copy). They're Thompson constructions:
+    fragments are linked by empty transitions, so that guards on their start states
+    are checked when they're entered
+    """
+
+    def __init__(self):
+        # states without transitions of a kind have None rather than an empty container,
+        # most states having a single kind of transitions
+        # per state: transitions on input, char -> list of target states
+        self.chars = []
+        # per state: list of (predicate, target state)
+        self.preds = []
+        # per state: list of targets of empty transitions
+        self.eps = []
+        # per state: tuple of conditions to be checked before entering it
+        self.guards = []
+
+    def __len__(self):
+        return len(self.chars)
+
+    def state(self):
+        """
+        Returns a new state
+        """
+        self.chars.append(None)
+        self.preds.append(None)
+        self.eps.append(None)
+        self.guards.append(())
+        return len(self.chars) - 1
+
+    # Add a transition from state fr to state to, on input
+    # (an empty transition if input is None, or a predicate if it's callable)
+    def add_transition(self, fr, input, to):
+        if input is None:
+            if self.eps[fr] is None:
+                self.eps[fr] = []
+            self.eps[fr].append(to)
+        elif callable(input):
+            if self.preds[fr] is None:
+                self.preds[fr] = []
+            self.preds[fr].append((input, to))
+        else:
+            if self.chars[fr] is None:
+                self.chars[fr] = {}
+            self.chars[fr].setdefault(input, []).append(to)
+
+    # add a guard to be checked before entering the state
+    def add_guard(self, state, cond):
+        if not callable(cond):
+            raise ValueError("cond must be function-like")
+        self.guards[state] += (cond,)
+
+    def fragment(self, start, end, lo):
+        """
+        Returns the fragment from start to end, made of the states from lo on, i.e all those added since
+        """
+        return Fragment(start, end, lo, len(self))
+
+    def char(self, input):
+        """
+        Returns a fragment matching a single char, looked up if input is a char, or tested if it's a predicate
+        """
+        start = self.state()
+        end = self.state()
+        self.add_transition(start, input, end)
+        return self.fragment(start, end, start)
+
+    def guard(self, cond):
+        """
+        Returns a fragment matching the empty string, if cond holds
+        """
+        start = self.state()
+        end = self.state()
+        self.add_transition(start, None, end)
+        self.add_guard(start, cond)
+        return self.fragment(start, end, start)
+
+    def union(self, frags):
+        """
+        Returns a fragment matching any of the fragments
+        """
+        start = self.state()
+        end = self.state()
+        for frag in frags:
+            self.add_transition(start, None, frag.start)
+            self.add_transition(frag.end, None, end)
+        return self.fragment(start, end, min(frag.lo for frag in frags))
+
+    def tagged_union(self, frags):
+        """
+        Like union, but the fragments' end states aren't linked to the end state, so that they tell
+        which fragment matched. Returns the union and the fragments' end states, in order
+        """
+        start = self.state()
+        end = self.state()
+        for frag in frags:
+            self.add_transition(start, None, frag.start)
+        lo = min([frag.lo for frag in frags] + [start])
+        return self.fragment(start, end, lo), [frag.end for frag in frags]
+
+    def concat(self, frags):
+        """
+        Returns a fragment matching the fragments one after the other
+        """
+        for prev, frag in zip(frags, frags[1:]):
+            self.add_transition(prev.end, None, frag.start)
+        return Fragment(frags[0].start, frags[-1].end,
+                        min(frag.lo for frag in frags), max(frag.hi for frag in frags))
+
+    def plus(self, frag):
+        """
+        Returns a fragment matching the fragment one or more times
+        """
+        # the end state is linked back to the fragment's start state,
+        # so that guards on it aren't checked when the loop is skipped (see star)
+        start = self.state()
+        end = self.state()
+        self.add_transition(start, None, frag.start)
+        self.add_transition(frag.end, None, end)
+        self.add_transition(frag.end, None, frag.start)
+        return self.fragment(start, end, frag.lo)
+
+    def star(self, frag):
+        """
+        Returns a fragment matching the fragment zero or more times
+        """
+        res = self.plus(frag)
+        self.add_transition(res.start, None, res.end)
+        return res
+
+    def opt(self, frag):
+        """
+        Returns a fragment matching the fragment zero or one time
+        """
+        start = self.state()
+        end = self.state()
+        self.add_transition(start, None, frag.start)
+        self.add_transition(frag.end, None, end)
+        self.add_transition(start, None, end)
+        return self.fragment(start, end, frag.lo)
+
+    def repeat(self, frag, n, m):
+        """
+        Returns a fragment matching the fragment n to m times (with 0 < m)
+
+        A chain of m copies, each one's end state linked to the next one's start state,
+        that can be left after the n-th copy on. Like plus, copies are left from their end state,
+        so that guards on the next copy's start state aren't checked when it's skipped
+        """
+        copies = [frag] + [self.copy(frag) for _ in range(m - 1)]
+        start = self.state()
+        end = self.state()
+        self.add_transition(start, None, frag.start)
+        for i, copy in enumerate(copies):
+            if i > 0:
+                self.add_transition(copies[i-1].end, None, copy.start)
+            if i + 1 >= n:
+                # leave after the (i+1)-th copy
+                self.add_transition(copy.end, None, end)
+        if n == 0:
+            self.add_transition(start, None, end)
+        return self.fragment(start, end, frag.lo)
+
+    def copy(self, frag):
+        """
+        Returns a copy of the fragment, appended to the arena
+        """
+        offset = len(self) - frag.lo
+        for state in range(frag.lo, frag.hi):
+            chars = self.chars[state]
+            preds = self.preds[state]
+            eps = self.eps[state]
+            self.chars.append(chars and {c: [to + offset for to in targets] for c, targets in chars.items()})
+            self.preds.append(preds and [(pred, to + offset) for pred, to in preds])
+            self.eps.append(eps and [to + offset for to in eps])
+            self.guards.append(self.guards[state])
+        return Fragment(frag.start + offset, frag.end + offset, frag.lo + offset, frag.hi + offset)
+
+    def freeze(self, frag, tags=()):
+        """
+        Returns the program matching the fragment (see program.Program), optimized (see optimize.py),
+        keeping track of the given tagged states (see tagged_union)
+        """
+        if self.guards[frag.start]:
+            # the program's start state is entered without checking guards
+            start = self.state()
+            self.add_transition(start, None, frag.start)
+            frag = self.fragment(start, frag.end, frag.lo)
+        # the fragment's start and end states get the program's fixed ids, other states keep their order
+        order = [frag.start, frag.end]
+        order.extend(state for state in range(len(self)) if state != frag.start and state != frag.end)
+        ids = [0] * len(order)
+        for i, state in enumerate(order):
+            ids[state] = i
+
+        states = []
+        for state in order:
+            chars = self.chars[state]
+            preds = self.preds[state]
+            eps = self.eps[state]
+            chars = {c: tuple(sorted({ids[to] for to in targets}))
+                     for c, targets in chars.items()} if chars else {}
+            preds = tuple(dict.fromkeys((pred, ids[to]) for pred, to in preds)) if preds else ()
+            eps = tuple(dict.fromkeys(ids[to] for to in eps)) if eps else ()
+            states.append(State(chars, preds, eps, self.guards[state]))
+        res = Program(states)
+        res.tags = tuple(ids[state] for state in tags)
+        return optimize(res)
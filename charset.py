@@ -0,0 +1,145 @@
+
+from bisect import bisect_right
+import re
+
+MAX_CODEPOINT = 0x10FFFF
+# size of the bitmap fast path (ASCII and Latin-1)
+_BITMAP_SIZE = 256
+
+
+class CharSet:
+    """
+    An immutable set of chars, stored as a sorted table of disjoint codepoint ranges
+
+    Membership is tested through a bitmap for ASCII/Latin-1 and a binary search otherwise.
+    Instances are callable, so they can be used as NFA predicates
+    """
+    __slots__ = ("ranges", "_starts", "_ends", "_bitmap")
+
+    def __init__(self, ranges=()):
+        # sort and merge overlapping or adjacent ranges
+        merged = []
+        for lo, hi in sorted(ranges):
+            if lo > hi:
+                raise ValueError("invalid bounds in char range")
+            if merged and lo <= merged[-1][1] + 1:
+                if hi > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], hi)
+            else:
+                merged.append((lo, hi))
+        # tuple of inclusive (lo, hi) codepoint ranges
+        self.ranges = tuple(merged)
+        self._starts = [lo for lo, _ in merged]
+        self._ends = [hi for _, hi in merged]
+        bitmap = bytearray(_BITMAP_SIZE)
+        for lo, hi in merged:
+            if lo >= _BITMAP_SIZE:
+                break
+            hi = min(hi, _BITMAP_SIZE - 1)
+            bitmap[lo:hi+1] = b"\x01" * (hi - lo + 1)
+        self._bitmap = bytes(bitmap)
+
+    @classmethod
+    def of(cls, *chars):
+        """
+        Returns the set of the given chars
+        """
+        return cls((ord(c), ord(c)) for c in chars)
+
+    @classmethod
+    def between(cls, start, end):
+        """
+        Returns the set of chars from start to end, inclusive
+        """
+        return cls(((ord(start), ord(end)),))
+
+    def __call__(self, x):
+        cp = ord(x)
+        if cp < _BITMAP_SIZE:
+            return self._bitmap[cp] == 1
+        i = bisect_right(self._starts, cp) - 1
+        return i >= 0 and cp <= self._ends[i]
+
+    def __contains__(self, x):
+        return self(x)
+
+    def __or__(self, rhs):
+        return CharSet(self.ranges + rhs.ranges)
+
+    def __invert__(self):
+        res = []
+        lo = 0
+        for start, end in self.ranges:
+            if start > lo:
+                res.append((lo, start - 1))
+            lo = end + 1
+        if lo <= MAX_CODEPOINT:
+            res.append((lo, MAX_CODEPOINT))
+        return CharSet(res)
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, CharSet) and self.ranges == rhs.ranges
+
+    def __hash__(self):
+        return hash(self.ranges)
+
+    def __len__(self):
+        return sum(hi - lo + 1 for lo, hi in self.ranges)
+
+    def single(self):
+        """
+        Returns the only char in the set, or None if there's not exactly one
+        """
+        if len(self.ranges) == 1 and self.ranges[0][0] == self.ranges[0][1]:
+            return chr(self.ranges[0][0])
+        return None
+
+    def __repr__(self):
+        return "CharSet(" + repr(self.ranges) + ")"
+
+
+# char classes defined by str methods, computed on first use
+_classes = None
+
+
+def _str_class(name):
+    global _classes
+    classes = _classes
+    if classes is None:
+        # scan every codepoint once for all of them, then publish them all at once,
+        # so that threads compiling patterns at the same time never see some missing
+        classes = {}
+        every_char = "".join(map(chr, range(MAX_CODEPOINT + 1)))
+        for method in ("isdigit", "isalnum", "isspace"):
+            flags = bytes(map(getattr(str, method), every_char))
+            classes[method] = CharSet((m.start(), m.end() - 1)
+                                      for m in re.finditer(b"\x01+", flags))
+        _classes = classes
+    return classes[name]
+
+
+def digits():
+    """
+    Chars matched by \\d, as per str.isdigit
+    """
+    return _str_class("isdigit")
+
+
+def alphanums():
+    """
+    Chars matched by \\w, as per str.isalnum
+    """
+    return _str_class("isalnum")
+
+
+def spaces():
+    """
+    Chars matched by \\s, as per str.isspace
+    """
+    return _str_class("isspace")
+
+
+# every char
+ANY = CharSet(((0, MAX_CODEPOINT),))
+# chars matched by the wildcard
+WILDCARD = ~CharSet.of('\n')
@@ -0,0 +1,188 @@
+
+"""
+Code generation backend, compiling a Program into a specialized Python function
+
+The program is turned into a DFA up front, by subset construction, and the DFA into
+the source of a function looping over the input: the DFA state is a local int,
+picked out by a tree of comparisons, and each state's transitions are an if chain
+over the ranges of chars leading to the same state, so that stepping over a char
+involves no dict lookups nor predicate calls (but for char classes of many ranges,
+looked up in a set, or a bitmap over bytes).
+
+Only programs without guards can be compiled, as guards depend on the position in the input
+"""
+from charset import CharSet
+import utf8
+
+# programs whose DFA has more states than this aren't compiled
+MAX_STATES = 256
+# char tests made of more ranges than this look the char up rather than being inlined
+_MAX_INLINE_RANGES = 4
+# max number of code objects cached by source
+_CACHE_SIZE = 256
+
+# source -> code object, so that programs compiled to the same source share it
+_code_cache = {}
+
+
+class Generated:
+    """
+    The functions generated for a program, along with their source
+    """
+
+    def __init__(self, source, is_match):
+        self.source = source
+        # is_match(input) returns True if a non-empty match ends anywhere in the input,
+        # or if the input is empty and matched (see program.Matcher.is_match)
+        self.is_match = is_match
+
+
+def generate(prog):
+    """
+    Returns the functions generated for a program (see Generated), or None if it can't be compiled,
+    i.e if it has guards or its DFA would have more than MAX_STATES states
+    """
+    if prog.has_guards:
+        return None
+    binary = prog.is_binary()
+    dfa = _build_dfa(prog, binary)
+    if dfa is None:
+        return None
+    # char sets and tables the generated code looks chars up in, by name
+    constants = {}
+    source = _source(dfa, prog.END in prog.start_closure, binary, constants)
+    code = _code_cache.get(source)
+    if code is None:
+        if len(_code_cache) >= _CACHE_SIZE:
+            _code_cache.clear()
+        code = _code_cache[source] = compile(source, "<regex codegen>", "exec")
+    namespace = dict(constants)
+    exec(code, namespace)
+    return Generated(source, namespace["is_match"])
+
+
+# returns the transitions of the DFA running the program anew from every pos (see Program.match_ends),
+# as a list, indexed by DFA state, of lists of (ranges, next DFA state, accepts),
+# or None if it has too many states. The start state is 0, and is also where chars
+# without a transition lead. accepts is True if a non-empty match ends after the transition
+def _build_dfa(prog, binary):
+    start = prog.start_closure
+    ids = {start: 0}
+    order = [start]
+    res = []
+    for states in order:
+        transitions = []
+        for (to, accepts), ranges in _transitions(prog, states, start, binary).items():
+            if to not in ids:
+                if len(order) >= MAX_STATES:
+                    return None
+                ids[to] = len(order)
+                order.append(to)
+            transitions.append((ranges, ids[to], accepts))
+        res.append(transitions)
+    return res
+
+
+# returns the transitions of a set of states, as (next set of states, accepts) -> codepoint ranges,
+# the next set of states having the start state added back in
+def _transitions(prog, states, start, binary):
+    # split the alphabet where any of the states' transitions start or end
+    points = set()
+    for state in states:
+        st = prog.states[state]
+        for c in st.chars:
+            cp = c if binary else ord(c)
+            points.add(cp)
+            points.add(cp + 1)
+        for pred, _ in st.preds:
+            for lo, hi in pred.ranges:
+                points.add(lo)
+                points.add(hi + 1)
+    points = sorted(points)
+
+    res = {}
+    for lo, end in zip(points, points[1:]):
+        # every char between lo and end leads to the same states as lo
+        reached = prog._step(states, lo if binary else chr(lo))
+        if not reached:
+            continue
+        key = (frozenset(reached) | start, prog.END in reached)
+        ranges = res.setdefault(key, [])
+        if ranges and ranges[-1][1] == lo - 1:
+            ranges[-1] = (ranges[-1][0], end - 1)
+        else:
+            ranges.append((lo, end - 1))
+    return res
+
+
+# returns the source of the is_match function running the DFA
+def _source(dfa, start_accepts, binary, constants):
+    lines = [
+        "def is_match(input):",
+        "    if not input:",
+        f"        return {start_accepts}",
+        "    state = 0",
+        "    for c in input:",
+    ]
+    # the start state is where most chars lead, so it's tested first
+    lines.append("        if state == 0:")
+    lines += _state_body(dfa, 0, 3, binary, constants)
+    if len(dfa) > 1:
+        lines.append("        else:")
+        lines += _dispatch(dfa, 1, len(dfa) - 1, 3, binary, constants)
+    lines.append("    return False")
+    return "\n".join(lines) + "\n"
+
+
+# returns the lines picking out the states from lo to hi by bisection, and running them
+def _dispatch(dfa, lo, hi, depth, binary, constants):
+    pad = "    " * depth
+    if lo == hi:
+        return _state_body(dfa, lo, depth, binary, constants)
+    mid = (lo + hi + 1) // 2
+    return ([pad + f"if state < {mid}:"] +
+            _dispatch(dfa, lo, mid - 1, depth + 1, binary, constants) +
+            [pad + "else:"] +
+            _dispatch(dfa, mid, hi, depth + 1, binary, constants))
+
+
+# returns the lines stepping a state over c
+def _state_body(dfa, state, depth, binary, constants):
+    pad = "    " * depth
+    lines = []
+    for ranges, to, accepts in dfa[state]:
+        keyword = "elif" if lines else "if"
+        lines.append(pad + f"{keyword} {_test(ranges, binary, constants)}:")
+        lines.append(pad + ("    return True" if accepts else f"    state = {to}"))
+    if state != 0:
+        if lines:
+            lines.append(pad + "else:")
+            lines.append(pad + "    state = 0")
+        else:
+            lines.append(pad + "state = 0")
+    elif not lines:
+        lines.append(pad + "pass")
+    return lines
+
+
+# returns the expression testing if c is in the ranges
+def _test(ranges, binary, constants):
+    if len(ranges) > _MAX_INLINE_RANGES:
+        name = f"_set{len(constants)}"
+        if binary:
+            # a bitmap, indexed by the byte
+            constants[name] = utf8.ByteSet(ranges)._bitmap
+            return f"{name}[c]"
+        # Latin-1 chars are looked up in a set, the others in the char set
+        chars = CharSet(ranges)
+        constants[name] = chars
+        constants[name + "_low"] = frozenset(chr(cp) for cp in range(256) if chars(chr(cp)))
+        return f"(c in {name}_low if c < '\\u0100' else {name}(c))"
+    tests = []
+    for lo, hi in ranges:
+        lo_lit, hi_lit = (lo, hi) if binary else (repr(chr(lo)), repr(chr(hi)))
+        if lo == hi:
+            tests.append(f"c == {lo_lit}")
+        else:
+            tests.append(f"{lo_lit} <= c <= {hi_lit}")
+    return " or ".join(tests)
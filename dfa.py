@@ -0,0 +1,389 @@
+
+from bisect import bisect_right
+import sys
+import threading
+
+# default memory budget of a lazy DFA's cache, in (approximate) bytes
+DEFAULT_BUDGET = 1 << 21
+# approximate cost of a single cached transition (dict slot + key + value)
+_TRANSITION_COST = 100
+# the cache is thrashing if it's flushed before having stepped over
+# at least this many chars per DFA state built
+_MIN_STEPS_PER_STATE = 10
+# give up on the DFA after this many consecutive thrashing flushes
+_MAX_BAD_FLUSHES = 3
+
+
+class DState:
+    """
+    A state of a lazy DFA, i.e a set of NFA states
+    """
+    __slots__ = ("states", "accepts", "next", "seeded", "tags")
+
+    def __init__(self, states, accepts):
+        # the (frozen) set of NFA states this DFA state stands for
+        self.states = states
+        # True if the set contains the NFA's final state
+        self.accepts = accepts
+        # cached transitions, char -> DState
+        self.next = {}
+        # this state with the NFA's start state(s) added back in (see Program.match_ends)
+        self.seeded = None
+        # the tagged NFA states in the set, computed on demand (see Program.match_tags)
+        self.tags = None
+
+
+class LazyDFA:
+    """
+    A DFA built on the fly by subset construction over an NFA
+
+    Transitions are computed by the NFA the first time they're taken, then cached,
+    so that stepping over a char becomes a single dict lookup.
+    The cache is flushed once it outgrows its memory budget, and the DFA gives up
+    (see LazyDFA.failed) if it keeps getting flushed without paying off.
+
+    Only valid for automata without guards, as guards depend on the position in the input.
+    Can be stepped by many threads at once: cache misses and flushes take a lock
+    """
+
+    def __init__(self, fa, budget=DEFAULT_BUDGET):
+        self.fa = fa
+        # memory budget in bytes
+        self.budget = budget
+        # interned DFA states, frozenset -> DState
+        self.dstates = {}
+        self.used = 0
+        self.steps = 0
+        self.flushes = 0
+        self.bad_flushes = 0
+        # set when the cache thrashes, the owner should fall back to the NFA
+        self.failed = False
+        self._lock = threading.RLock()
+        self.start = self.intern(self.fa.resolve_et({fa.START}))
+
+    def intern(self, states):
+        """
+        Returns the DFA state standing for the given set of NFA states
+        """
+        states = frozenset(states)
+        d = self.dstates.get(states)
+        if d is None:
+            with self._lock:
+                d = self.dstates.get(states)
+                if d is None:
+                    d = DState(states, self.fa.END in states)
+                    self.dstates[states] = d
+                    self.used += sys.getsizeof(states) + sys.getsizeof(d)
+        return d
+
+    def step(self, d, input):
+        """
+        Returns the DFA state reached from d on input
+        """
+        self.steps += 1
+        nxt = d.next.get(input)
+        if nxt is None:
+            nxt = self._build(d, input)
+        return nxt
+
+    def seed(self, d):
+        """
+        Returns d with the start state(s) added back in
+        """
+        nxt = d.seeded
+        if nxt is None:
+            with self._lock:
+                if self.used >= self.budget:
+                    self.flush()
+                    d = self.intern(d.states)
+                nxt = self.intern(d.states | self.start.states)
+                d.seeded = nxt
+        return nxt
+
+    def _build(self, d, input):
+        with self._lock:
+            if self.used >= self.budget:
+                self.flush()
+                d = self.intern(d.states)
+            nxt = self.intern(self.fa._step(d.states, input))
+            d.next[input] = nxt
+            self.used += _TRANSITION_COST
+        return nxt
+
+    def flush(self):
+        """
+        Empty the cache, keeping the start state around
+        """
+        with self._lock:
+            if self.steps < _MIN_STEPS_PER_STATE * len(self.dstates):
+                self.bad_flushes += 1
+                if self.bad_flushes >= _MAX_BAD_FLUSHES:
+                    self.failed = True
+            else:
+                self.bad_flushes = 0
+            self.flushes += 1
+            # unlink the old states so that they can be collected,
+            # states still held by callers just stop being cached
+            for d in self.dstates.values():
+                d.next = {}
+                d.seeded = None
+            self.dstates = {self.start.states: self.start}
+            self.used = sys.getsizeof(self.start.states) + \
+                sys.getsizeof(self.start)
+            self.steps = 0
+
+
+# minimal DFAs built from more DFA states than this (before minimization) aren't built
+MAX_STATES = 1 << 12
+
+
+def minimal(prog, anchored=True, max_states=MAX_STATES):
+    """
+    Returns the minimal DFA of a program (see MinimalDFA), or None if it can't be built:
+    if the program has guards, or subset construction yields more than max_states states
+
+    The DFA is built eagerly, by subset construction over the classes of chars no transition
+    tells apart (see _alphabet), then minimized with Hopcroft's algorithm.
+    If anchored, it accepts the inputs the program matches as a whole, otherwise it's run anew
+    from every pos and accepts after any char a non-empty match ends at (see Program.match_ends)
+    """
+    if prog.has_guards:
+        return None
+    binary = prog.is_binary()
+    points, columns, reps = _alphabet(prog, binary)
+
+    start = prog.start_closure
+    # DFA states are (NFA states, accepts), the dead state being 0
+    dead = (frozenset(), False)
+    first = (start, prog.END in start) if anchored else (start, False)
+    ids = {dead: 0, first: 1}
+    order = [dead, first]
+    rows = []
+    for states, _ in order:
+        # where chars without transitions lead: nowhere, or back to the start if run anew from every pos
+        nowhere = 0 if anchored or not states else 1
+        row = []
+        for rep in reps:
+            if not states or rep is None:
+                row.append(nowhere)
+                continue
+            reached = frozenset(prog._step(states, rep))
+            to = (reached if anchored else reached | start, prog.END in reached)
+            if to not in ids:
+                if len(order) >= max_states:
+                    return None
+                ids[to] = len(order)
+                order.append(to)
+            row.append(ids[to])
+        rows.append(row)
+    accepts = [acc for _, acc in order]
+    rows, accepts, start_id = _minimize(rows, accepts)
+    rows, merged = _merge_classes(rows)
+    class_map = [merged[k] for k in columns]
+    return MinimalDFA(points, class_map, rows, accepts, start_id, prog.END in start, binary)
+
+
+class MinimalDFA:
+    """
+    A minimal DFA, stored as a dense table of state ids indexed by state and char class
+
+    The chars from points[k-1] (included) to points[k] (excluded) are in class class_map[k],
+    the chars below every point and past the last one, which no transition of the program reads, in class 0.
+
+    Running it over an input is a class lookup and a table lookup per char.
+    State 0 is dead: every class leads back to it, and it doesn't accept
+    """
+
+    def __init__(self, points, class_map, rows, accepts, start, empty, binary):
+        # sorted codepoints (or bytes) where classes start or end, and the class of each interval between them
+        self.points = points
+        self.class_map = class_map
+        # list, indexed by state, of the list of states each class leads to
+        self.rows = rows
+        # list of bool, True for accepting states
+        self.accepts = accepts
+        self.start = start
+        # True if the program matches empty input
+        self.empty = empty
+        self.binary = binary
+        # the table is flattened, states being stored premultiplied by the number of classes
+        width = len(rows[0])
+        self._table = [to * width for row in rows for to in row]
+        self._accepts = bytearray(len(self._table))
+        for state, acc in enumerate(accepts):
+            self._accepts[state * width] = acc
+        self._start = start * width
+        # classes of the Latin-1 chars (or bytes), looked up directly
+        self._classes = [class_map[bisect_right(points, cp)] for cp in range(256)]
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def num_classes(self):
+        return len(self.rows[0])
+
+    def __repr__(self):
+        return f"MinimalDFA(states={len(self)}, classes={self.num_classes})"
+
+    def fullmatch(self, input):
+        """
+        Returns True if the DFA accepts the input (as built anchored, if the program matches it as a whole)
+        """
+        return self._accepts[self._run(input, False)] == 1
+
+    def is_match(self, input):
+        """
+        Returns True if the DFA accepts after any char of the input (as built unanchored, if a non-empty match ends there),
+        or if the input is empty and the program matches it (see program.Matcher.is_match)
+        """
+        if len(input) == 0:
+            return self.empty
+        return self._accepts[self._run(input, True)] == 1
+
+    # returns the (premultiplied) state the DFA is in after the input, stopping early at the dead state,
+    # or at the first accepting state if first
+    def _run(self, input, first):
+        table = self._table
+        accepts = self._accepts
+        classes = self._classes
+        points = self.points
+        class_map = self.class_map
+        state = self._start
+        if self.binary:
+            for b in input:
+                state = table[state + classes[b]]
+                if state == 0 or (first and accepts[state]):
+                    break
+            return state
+        for c in input:
+            cp = ord(c)
+            state = table[state + (classes[cp] if cp < 256 else class_map[bisect_right(points, cp)])]
+            if state == 0 or (first and accepts[state]):
+                break
+        return state
+
+
+# returns the classes of chars no transition of the program tells apart, as (points, columns, reps):
+# the sorted codepoints (or bytes) where its transitions start or end, the class of each interval between them
+# (interval k being from points[k-1] to points[k], interval 0 below them all and the last one past them),
+# and a char of each class, class 0 being that of the chars without transitions, whose char is None.
+# Intervals are in the same class if they're in the same char classes (predicates), and aren't
+# a char of a transition: e.g. the hundreds of intervals of \w make up a single class
+def _alphabet(prog, binary):
+    points = set()
+    chars = set()
+    preds = {}
+    for st in prog.states:
+        for c in st.chars:
+            cp = c if binary else ord(c)
+            chars.add(cp)
+            points.add(cp)
+            points.add(cp + 1)
+        for pred, _ in st.preds:
+            preds[pred] = None
+            for lo, hi in pred.ranges:
+                points.add(lo)
+                points.add(hi + 1)
+    points = sorted(points)
+    index = {cp: k for k, cp in enumerate(points)}
+    # interval -> the predicates it's in
+    within = [[] for _ in range(len(points) + 1)]
+    for p, pred in enumerate(preds):
+        for lo, hi in pred.ranges:
+            for k in range(index[lo] + 1, index[hi + 1] + 1):
+                within[k].append(p)
+    classes = {((), None): 0}
+    columns = []
+    reps = [None]
+    for k, preds_in in enumerate(within):
+        lo = points[k - 1] if 0 < k < len(points) else None
+        key = (tuple(preds_in), lo if lo in chars else None)
+        c = classes.get(key)
+        if c is None:
+            c = classes[key] = len(reps)
+            reps.append(lo if binary else chr(lo))
+        columns.append(c)
+    return points, columns, reps
+
+
+# merges the classes leading to the same states from every state,
+# returns the rows of the merged classes and the merged class of each class
+def _merge_classes(rows):
+    columns = {}
+    class_map = []
+    firsts = []
+    for k in range(len(rows[0])):
+        column = tuple(row[k] for row in rows)
+        merged = columns.get(column)
+        if merged is None:
+            merged = columns[column] = len(firsts)
+            firsts.append(k)
+        class_map.append(merged)
+    return [[row[k] for k in firsts] for row in rows], class_map
+
+
+# minimizes a complete DFA, whose state 0 is dead and state 1 the start, with Hopcroft's algorithm:
+# states are split apart, starting from the accepting and non-accepting ones, until every state
+# of a block leads to the same blocks. Returns the rows and accepts of the DFA of the blocks, and its start,
+# the dead block being 0 (as is the start, if it's dead)
+def _minimize(rows, accepts):
+    width = len(rows[0])
+    # class -> state -> states leading to it
+    inverse = [{} for _ in range(width)]
+    for state, row in enumerate(rows):
+        for k, to in enumerate(row):
+            inverse[k].setdefault(to, []).append(state)
+
+    blocks = [set(), set()]
+    for state, acc in enumerate(accepts):
+        blocks[acc].add(state)
+    blocks = [block for block in blocks if block]
+    block_of = [0] * len(rows)
+    for b, block in enumerate(blocks):
+        for state in block:
+            block_of[state] = b
+    # blocks to split others by
+    pending = list(range(len(blocks)))
+    is_pending = set(pending)
+    while pending:
+        b = pending.pop()
+        is_pending.discard(b)
+        splitter = list(blocks[b])
+        for k in range(width):
+            into = inverse[k]
+            # states leading into the splitter on class k, by block
+            touched = {}
+            for to in splitter:
+                for fr in into.get(to, ()):
+                    touched.setdefault(block_of[fr], set()).add(fr)
+            for c, part in touched.items():
+                block = blocks[c]
+                if len(part) == len(block):
+                    continue
+                block -= part
+                new = len(blocks)
+                blocks.append(part)
+                for state in part:
+                    block_of[state] = new
+                # only the smaller half is needed to split others by, unless the block was still to be
+                if c in is_pending or len(part) <= len(block):
+                    pending.append(new)
+                    is_pending.add(new)
+                else:
+                    pending.append(c)
+                    is_pending.add(c)
+
+    # number the blocks in the order they're reached from the start, after the dead one
+    ids = {block_of[0]: 0}
+    order = [0]
+    if block_of[1] not in ids:
+        ids[block_of[1]] = 1
+        order.append(1)
+    for state in order:
+        for to in rows[state]:
+            if block_of[to] not in ids:
+                ids[block_of[to]] = len(order)
+                order.append(to)
+    new_rows = [[ids[block_of[to]] for to in rows[state]] for state in order]
+    return new_rows, [accepts[state] for state in order], ids[block_of[1]]
@@ -0,0 +1,170 @@
+
+"""
+A grep-like command line tool built on Regex
+
+Usage: python grep.py [-n] [-c | -l] [-j JOBS] PATTERN [FILE...]
+(or python regex.py ...)
+
+Files are memory-mapped and searched line by line, as bytes (see Regex's binary mode),
+each in a worker process. The literals every match contains one of are looked for over
+the whole file first, so that only the lines with one of them in get searched.
+Lines are searched in place, and only matching lines get copied out and decoded, for printing
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import mmap
+import os
+import sys
+import parallel
+import prefilter
+import regex
+
+
+def lines(mm, literals=None):
+    """
+    Yields the lines of a memory-mapped file, as (line number, line) without the trailing newline,
+    lines being memoryviews over the file rather than copies
+
+    If given literals (as bytes), only the lines with one of them in are yielded:
+    the literals are looked for over the whole file, skipping the lines in between at once
+    """
+    finder = prefilter.of(literals, 0) if literals else None
+    size = len(mm)
+    start = 0
+    lineno = 1
+    with memoryview(mm) as view:
+        while start < size:
+            if finder is not None:
+                found = finder.candidate(mm, start)
+                if found < 0:
+                    return
+                # skip to the start of the line the literal is in
+                skip_to = mm.rfind(b"\n", start, found) + 1
+                if skip_to > start:
+                    # mmaps can't count, the skipped lines are counted over a copy of them
+                    lineno += mm[start:skip_to].count(b"\n")
+                    start = skip_to
+            end = mm.find(b"\n", start)
+            if end < 0:
+                end = size
+            yield lineno, view[start:end]
+            start = end + 1
+            lineno += 1
+
+
+def grep_lines(reg, numbered_lines, mode):
+    """
+    Searches (line number, line) pairs for lines matching reg, and returns
+    the matching pairs, their count if mode is "count", or whether there's one if mode is "files".
+    Lines are bytes-like, and only get decoded if they match
+    """
+    res = []
+    for lineno, line in numbered_lines:
+        if reg.search(line) is None:
+            continue
+        if mode == "files":
+            return True
+        res.append((lineno, str(line, "utf-8", "replace")))
+    if mode == "files":
+        return False
+    if mode == "count":
+        return len(res)
+    return res
+
+
+def grep_file(reg, path, mode):
+    """
+    Searches a file for lines matching reg (see grep_lines), returns (path, result, error message)
+    """
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # empty files can't be mapped
+                return (path, grep_lines(reg, (), mode), None)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return (path, grep_lines(reg, lines(mm, _literals(reg)), mode), None)
+    except OSError as e:
+        return (path, None, f"{path}: {e.strerror}")
+
+
+# returns the literals every match of reg contains one of (see analysis.required_literals), or None
+def _literals(reg):
+    if reg.required is None:
+        return None
+    return reg.required[0]
+
+
+# grep_file, in a worker process set up by parallel.init_worker
+def _grep_file(path, mode):
+    return grep_file(parallel.worker_regex(), path, mode)
+
+
+def main(argv=None):
+    """
+    Runs the command line tool, returns its exit status:
+    0 if a line matched, 1 if none did, 2 on errors
+    """
+    argparser = argparse.ArgumentParser(
+        description="Print lines matching a pattern")
+    argparser.add_argument("pattern")
+    argparser.add_argument("files", nargs="*",
+                           help="files to search, stdin if none")
+    argparser.add_argument("-n", "--line-number", action="store_true",
+                           help="prefix lines with their line number")
+    modes = argparser.add_mutually_exclusive_group()
+    modes.add_argument("-c", "--count", action="store_true",
+                       help="only print the number of matching lines per file")
+    modes.add_argument("-l", "--files-with-matches", action="store_true",
+                       help="only print the names of files with matching lines")
+    argparser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                           help="number of worker processes")
+    args = argparser.parse_args(argv)
+
+    mode = "lines"
+    if args.count:
+        mode = "count"
+    elif args.files_with_matches:
+        mode = "files"
+
+    try:
+        reg = regex.compile(args.pattern, binary=True)
+    except SyntaxError as e:
+        print(f"invalid pattern: {e}", file=sys.stderr)
+        return 2
+
+    if not args.files:
+        stdin = (line.rstrip(b"\n") for line in sys.stdin.buffer)
+        results = [("(standard input)", grep_lines(
+            reg, enumerate(stdin, 1), mode), None)]
+    elif args.jobs > 1 and len(args.files) > 1:
+        with ProcessPoolExecutor(min(args.jobs, len(args.files)),
+                                 initializer=parallel.init_worker, initargs=(reg.dumps(),)) as pool:
+            results = pool.map(_grep_file, args.files,
+                               [mode] * len(args.files))
+    else:
+        results = map(grep_file, [reg] * len(args.files), args.files,
+                      [mode] * len(args.files))
+
+    with_filename = len(args.files) > 1
+    status = 1
+    for path, res, error in results:
+        if error is not None:
+            print(error, file=sys.stderr)
+            status = 2
+            continue
+        if res and status == 1:
+            status = 0
+        prefix = path + ":" if with_filename else ""
+        if mode == "files":
+            if res:
+                print(path)
+        elif mode == "count":
+            print(prefix + str(res))
+        else:
+            for lineno, line in res:
+                print(prefix + (f"{lineno}:" if args.line_number else "") + line)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,70 @@
+
+# newline, as a char and as a byte (see Program.to_bytes)
+NEWLINES = ('\n', 10)
+
+
+class Anchor:
+    """
+    A guard checking if the current pos is at the start (^) or the end ($) of a line
+
+    Works the same over chars and bytes
+    """
+    __slots__ = ("kind",)
+
+    def __init__(self, kind):
+        # '^' or '$'
+        self.kind = kind
+
+    def __call__(self, f):
+        # pos is that of the last char consumed
+        pos = f["pos"]
+        if self.kind == '^':
+            # at the start of input or after a newline
+            return pos < 0 or f["input"][pos] in NEWLINES
+        # at the end of input or before a newline
+        return pos == f["input_len"] - 1 or f["input"][pos + 1] in NEWLINES
+
+    def __repr__(self):
+        return "Anchor(" + repr(self.kind) + ")"
+
+
+class Lookaround:
+    """
+    A guard checking if an expression matches ahead of (or behind) the current pos
+
+    Instead of running the expression from every pos the guard is checked at,
+    it's run once over the whole input, in the opposite direction, flagging every pos
+    it matches from. Checking the guard is then a table lookup.
+    Tables are kept in the flags of the run (see program.Matcher), so that the guard can be shared
+    """
+
+    def __init__(self, fa, ahead, negate):
+        # Program matching the reversed expression for lookaheads, the expression itself for lookbehinds
+        self.fa = fa
+        self.ahead = ahead
+        self.negate = negate
+
+    def __call__(self, f):
+        tables = f["tables"]
+        table = tables.get(self)
+        if table is None:
+            table = tables[self] = self.table(f["input"])
+        # pos is that of the last char consumed
+        return table[f["pos"] + 1] != self.negate
+
+    def to_bytes(self, reverse=False):
+        """
+        Returns the guard checked over the UTF-8 encoded input (see Program.to_bytes),
+        reverse being True if that input is reversed
+        """
+        # lookaheads are run over the input reversed once more
+        return Lookaround(self.fa.to_bytes(reverse != self.ahead), self.ahead, self.negate)
+
+    def table(self, input):
+        """
+        Returns a bytearray flagging the positions of the input the expression matches from
+        """
+        if self.ahead:
+            # a match ending at pos i of the reversed input starts at len(input) - i
+            return self.fa.match_ends(input[::-1])[::-1]
+        return self.fa.match_ends(input)
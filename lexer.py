@@ -1,352 +1,400 @@
 
 from pprint import pprint
 
-# FIXME: dont use globals
-test = ""
-i = -1
-is_reverse = False
 
+def lex(string, reverse=False):
+    """
+    Returns the tree of a pattern
 
-def set_reverse(rev):
+    If reverse, concat exprs are reversed, e.g abc|def|g(hi)*j becomes cba|fed|j(ih)*g
     """
-    Set the lexer to reverse concat exprs
+    return Lexer(string, reverse).lex()
+
 
-    e.g abc|def|g(hi)*j becomes cba|fed|j(ih)*g
+class Lexer:
     """
-    global is_reverse
-    is_reverse = rev
-
-
-def peek(by_amt=1):
-    return test[i+1:i+by_amt+1] if i+by_amt < len(test) else None
-
-
-def m(a):
-    global i, test
-    i += 1
-    if test[i] != a:
-        raise SyntaxError(
-            f'expected \'{a}\', found \'{test[i]}\' at pos {i} of {test}')
-
-
-def lex(string):
-    global test, i
-    test = string
-    i = -1
-    return union_expr()
-
-
-def union_expr():
-    res = ()
-    while True:
-        r = anchored_expr()
-        if not r:
-            break
-        res += (r,)
-        if peek() != '|':
-            break
-        m('|')
-
-    if res != ():
-        return ("UNION_EXPR", res)
-    return None
-
-
-def anchored_expr():
-    tag = ''
-    if peek() == '^':
-        m('^')
-        tag += '^' if not is_reverse else '$'
-    res = concat_expr()
-    if peek() == '$':
-        m('$')
-        tag += '$' if not is_reverse else '^'
-    if res is None:
-        return None
-    if tag != '':
-        return ("ANCHORED_EXPR", tag, res)
-    else:
-        return res
+    A recursive descent lexer, turning a pattern into a tree
 
+    The cursor lives on the instance, so that patterns can be lexed concurrently
+    """
 
-def concat_expr():
-    res = ()
-    while True:
-        r = None
-        if peek(2) == '(?':
-            m('(')
-            m('?')
-            if peek() == ":":
-                m(':')
-                r = union_expr()
-            elif peek() == '<':
-                m('<')
-                r = lookbehind() if not is_reverse else lookahead()
-            else:
-                r = lookahead() if not is_reverse else lookbehind()
-            m(')')
-        else:
-            r = quantified_expr()
-        if not r:
-            break
-        # ordering depends on is_reverse
-        if not is_reverse:
-            res += (r,)
-        else:
-            res = (r,) + res
-    if res == ():
-        return None
-    return ("CONCAT_EXPR", res)
+    def __init__(self, string, reverse=False):
+        # the pattern, and the pos of the last char consumed
+        self.test = string
+        self.i = -1
+        # True if concat exprs are reversed (see lex)
+        self.is_reverse = reverse
+
+    def peek(self, by_amt=1):
+        return self.test[self.i+1:self.i+by_amt+1] if self.i+by_amt < len(self.test) else None
+
+    def m(self, a):
+        self.i += 1
+        if self.i >= len(self.test):
+            raise SyntaxError(f'expected \'{a}\', found the end of {self.test}')
+        if self.test[self.i] != a:
+            raise SyntaxError(
+                f'expected \'{a}\', found \'{self.test[self.i]}\' at pos {self.i} of {self.test}')
+
+    def lex(self):
+        """
+        Returns the tree of the pattern
+
+        Raises SyntaxError if the pattern isn't a single expression, e.g if it's empty or has an unmatched ')'
+        """
+        self.i = -1
+        res = self.union_expr()
+        if self.i + 1 < len(self.test):
+            raise SyntaxError(
+                f'unexpected \'{self.test[self.i+1]}\' at pos {self.i+1} of {self.test}')
+        if res is None:
+            raise SyntaxError(f'expected an expression, found none in \'{self.test}\'')
+        return res
 
+    def union_expr(self):
+        # kids are collected in a list, as growing a tuple would copy it every time
+        res = []
+        while True:
+            r = self.anchored_expr()
+            if not r:
+                if res:
+                    # empty alternatives aren't supported
+                    raise SyntaxError(f'expected an expression after \'|\' at pos {self.i} of {self.test}')
+                break
+            res.append(r)
+            if self.peek() != '|':
+                break
+            self.m('|')
 
-def quantified_expr():
-    res = expr()
-    tag = None
-    if peek() == '*':
-        m('*')
-        if peek() == '?':
-            m('?')
-            tag = "LAZY_KLEENE"
-        else:
-            tag = "KLEENE"
-    elif peek() == '+':
-        m('+')
-        if peek() == '?':
-            m('?')
-            tag = "LAZY_MATCH"
-        else:
-            tag = "MATCH"
-    elif peek() == '?':
-        m('?')
-        if peek() == '?':
-            m('?')
-            tag = "LAZY_OPT"
-        else:
-            tag = "OPT"
-    elif peek() == '{':
-        m('{')
-        r = range_expr()
-        m('}')
-        if r:
-            return (r, res)
-        raise SyntaxError("invalid range expr")
-    if tag and res:
-        return (tag, res)
-    return res
-
-
-def lookahead():
-    if peek() == '!':
-        m('!')
-        return ("LOOKAHEAD_NEG", union_expr())
-    elif peek() == '=':
-        m('=')
-        return ("LOOKAHEAD", union_expr())
-    else:
-        raise SyntaxError("invalid lookahead expression")
-
-
-def lookbehind():
-    is_currently_reversed = is_reverse
-    if peek() == '!':
-        m('!')
-        set_reverse(not is_currently_reversed)
-        r = union_expr()
-        set_reverse(is_currently_reversed)
-        return ("LOOKBEHIND_NEG", r) if r else None
-    elif peek() == '=':
-        m('=')
-        set_reverse(not is_currently_reversed)
-        r = union_expr()
-        set_reverse(is_currently_reversed)
-        return ("LOOKBEHIND", r) if r else None
-    else:
-        raise SyntaxError("invalid lookahead expression")
-
-
-def range_expr():
-    if peek() == ',':
-        # range is of type ',NUM'
-        m(',')
-        n1 = num()
-        if n1 is not None:
-            return ("RANGE", (",N", n1))
-        return None
-    n1 = num()
-    if n1 is None:
+        if res:
+            return ("UNION_EXPR", tuple(res))
         return None
-    if peek() == ',':
-        m(',')
-        n2 = num()
-        if n2 is not None:
-            return ("RANGE", ("N,N", n1, n2))
-        else:
-            return ("RANGE", ("N,", n1))
-    return ("RANGE", ("N", n1))
-
 
-def num():
-    res = None
-    while True:
-        unk = peek()
-        if unk.isdigit():
-            m(unk)
-            res = int(unk) if res is None else res*10 + int(unk)
+    def anchored_expr(self):
+        tag = ''
+        if self.peek() == '^':
+            self.m('^')
+            tag += '^' if not self.is_reverse else '$'
+        res = self.concat_expr()
+        if self.peek() == '$':
+            self.m('$')
+            tag += '$' if not self.is_reverse else '^'
+        if res is None:
+            return None
+        if tag != '':
+            return ("ANCHORED_EXPR", tag, res)
         else:
             return res
 
+    def concat_expr(self):
+        res = []
+        while True:
+            r = None
+            if self.peek(2) == '(?':
+                self.m('(')
+                self.m('?')
+                if self.peek() == ":":
+                    self.m(':')
+                    r = self.union_expr()
+                elif self.peek() == '<':
+                    self.m('<')
+                    r = self.lookbehind() if not self.is_reverse else self.lookahead()
+                else:
+                    r = self.lookahead() if not self.is_reverse else self.lookbehind()
+                self.m(')')
+            else:
+                r = self.quantified_expr()
+            if not r:
+                break
+            res.append(r)
+        if not res:
+            return None
+        # ordering depends on self.is_reverse
+        if self.is_reverse:
+            res.reverse()
+        return ("CONCAT_EXPR", tuple(res))
+
+    def quantified_expr(self):
+        res = self.expr()
+        # pos of the quantifier, if any
+        pos = self.i + 1
+        tag = None
+        if self.peek() == '*':
+            self.m('*')
+            if self.peek() == '?':
+                self.m('?')
+                tag = "LAZY_KLEENE"
+            else:
+                tag = "KLEENE"
+        elif self.peek() == '+':
+            self.m('+')
+            if self.peek() == '?':
+                self.m('?')
+                tag = "LAZY_MATCH"
+            else:
+                tag = "MATCH"
+        elif self.peek() == '?':
+            self.m('?')
+            if self.peek() == '?':
+                self.m('?')
+                tag = "LAZY_OPT"
+            else:
+                tag = "OPT"
+        elif self.peek() == '{':
+            self.m('{')
+            r = self.range_expr()
+            self.m('}')
+            if not r:
+                raise SyntaxError("invalid range expr")
+            tag = r
+        if tag is not None and res is None:
+            raise SyntaxError(f'nothing to repeat at pos {pos} of {self.test}')
+        if tag:
+            return (tag, res)
+        return res
 
-def expr():
-    res = None
-    if peek() == '(':
-        m('(')
-        res = union_expr()
-        m(')')
-    else:
-        res = enclosed_expr()
+    def lookahead(self):
+        if self.peek() == '!':
+            self.m('!')
+            return ("LOOKAHEAD_NEG", self.lookaround_body())
+        elif self.peek() == '=':
+            self.m('=')
+            return ("LOOKAHEAD", self.lookaround_body())
+        else:
+            raise SyntaxError("invalid lookahead expression")
+
+    def lookbehind(self):
+        is_currently_reversed = self.is_reverse
+        if self.peek() == '!':
+            self.m('!')
+            self.is_reverse = not is_currently_reversed
+            r = self.lookaround_body()
+            self.is_reverse = is_currently_reversed
+            return ("LOOKBEHIND_NEG", r)
+        elif self.peek() == '=':
+            self.m('=')
+            self.is_reverse = not is_currently_reversed
+            r = self.lookaround_body()
+            self.is_reverse = is_currently_reversed
+            return ("LOOKBEHIND", r)
+        else:
+            raise SyntaxError("invalid lookahead expression")
 
-    if res:
-        return ("EXPR", res)
-    return None
+    def lookaround_body(self):
+        res = self.union_expr()
+        if res is None:
+            raise SyntaxError(f'expected an expression in lookaround at pos {self.i} of {self.test}')
+        return res
 
+    def range_expr(self):
+        if self.peek() == ',':
+            # range is of type ',NUM'
+            self.m(',')
+            n1 = self.num()
+            if n1 is not None:
+                return ("RANGE", (",N", n1))
+            return None
+        n1 = self.num()
+        if n1 is None:
+            return None
+        if self.peek() == ',':
+            self.m(',')
+            n2 = self.num()
+            if n2 is not None:
+                return ("RANGE", ("N,N", n1, n2))
+            else:
+                return ("RANGE", ("N,", n1))
+        return ("RANGE", ("N", n1))
 
-'''
-ENCLOSED_EXPR -> EXTENDED_CHAR || CHAR_CLASS || ε
+    def num(self):
+        res = None
+        while True:
+            unk = self.peek()
+            if unk is not None and unk.isdigit():
+                self.m(unk)
+                res = int(unk) if res is None else res*10 + int(unk)
+            else:
+                return res
 
-ENCLOSED_EXPR -> EXTENDED_CHAR ENCLOSED_EXPR' || CHAR_CLASS ENCLOSED_EXPR' 
-ENCLOSED_EXPR' -> ENCLOSED_EXPR ENCLOSED_EXPR' || ε
-'''
+    def expr(self):
+        res = None
+        if self.peek() == '(':
+            self.m('(')
+            res = self.union_expr()
+            self.m(')')
+        else:
+            res = self.enclosed_expr()
 
+        if res:
+            return ("EXPR", res)
+        return None
 
-def enclosed_expr():
-    res = extended_char()
-    if res:
-        return res
-    res = char_class()
-    if res:
-        return res
-    return None
+    '''
+    ENCLOSED_EXPR -> EXTENDED_CHAR || CHAR_CLASS || ε
 
+    ENCLOSED_EXPR -> EXTENDED_CHAR ENCLOSED_EXPR' || CHAR_CLASS ENCLOSED_EXPR' 
+    ENCLOSED_EXPR' -> ENCLOSED_EXPR ENCLOSED_EXPR' || ε
+    '''
 
-def extended_char():
-    if peek() == '\\':
-        m('\\')
-        res = None
-        if peek() in "dDwWsStrnvf0":
-            spc_char = peek()
-            m(spc_char)
-            return ("EXTENDED_CHAR", ("SPECIAL_CHAR", spc_char))
-        elif peek() == 'x':
-            res = ascii_char()
-        elif peek() == 'u':
-            res = unicode_char()
-        else:
-            # try to parse as char
-            res = char(True)
+    def enclosed_expr(self):
+        res = self.extended_char()
         if res:
-            return ("EXTENDED_CHAR", res)
-        else:
-            raise SyntaxError("unrecognised escaped char "+peek())
-    else:
-        res = char()
-        if not res:
-            return None
-        return ("EXTENDED_CHAR", res)
+            return res
+        res = self.char_class()
+        if res:
+            return res
+        return None
 
+    def extended_char(self):
+        if self.peek() == '\\':
+            self.m('\\')
+            res = None
+            if self.peek() is None:
+                raise SyntaxError(f"expected an escaped char, found the end of {self.test}")
+            if self.peek() in "dDwWsStrnvf0":
+                spc_char = self.peek()
+                self.m(spc_char)
+                return ("EXTENDED_CHAR", ("SPECIAL_CHAR", spc_char))
+            elif self.peek() == 'x':
+                res = self.ascii_char()
+            elif self.peek() == 'u':
+                res = self.unicode_char()
+            else:
+                # try to parse as char
+                res = self.char(True)
+            if res:
+                return ("EXTENDED_CHAR", res)
+            else:
+                raise SyntaxError("unrecognised escaped char "+self.peek())
+        else:
+            res = self.char()
+            if not res:
+                return None
+            return ("EXTENDED_CHAR", res)
 
-def char(escaped=False):
-    unk_char = peek()
-    if not unk_char:
+    def char(self, escaped=False):
+        unk_char = self.peek()
+        if not unk_char:
+            return None
+        if unk_char not in ".?*+[]}{()|\\^$" or escaped:
+            self.m(unk_char)
+            return ("CHAR", unk_char)
+        elif unk_char == '.':
+            self.m(unk_char)
+            return ("WILDCARD", None)
         return None
-    if unk_char not in ".?*+[]}{()|\\^$" or escaped:
-        m(unk_char)
-        return ("CHAR", unk_char)
-    elif unk_char == '.':
-        m(unk_char)
-        return ("WILDCARD", None)
-    return None
-
-
-def ascii_char():
-    m('x')
-    hex_string = ""
-    for _ in range(2):
-        hex_char = peek()
-        if hex_char in "0123456789ABCDEF":
-            m(hex_char)
-            hex_string += hex_char
-        else:
-            # return None
-            raise SyntaxError("invalid ascii codepoint")
-    return ("ASCII_CP", hex_string)
-
-
-def unicode_char():
-    m('u')
-    hex_string = ""
-    for _ in range(4):
-        hex_char = peek()
-        if hex_char in "0123456789ABCDEFabcdef":
-            m(hex_char)
+
+    def ascii_char(self):
+        self.m('x')
+        hex_string = ""
+        for _ in range(2):
+            hex_char = self.peek()
+            if hex_char is not None and hex_char in "0123456789ABCDEF":
+                self.m(hex_char)
+                hex_string += hex_char
+            else:
+                # return None
+                raise SyntaxError("invalid ascii codepoint")
+        return ("ASCII_CP", hex_string)
+
+    def unicode_char(self):
+        self.m('u')
+        hex_string = ""
+        for _ in range(4):
+            hex_char = self.peek()
+            if hex_char is not None and hex_char in "0123456789ABCDEFabcdef":
+                self.m(hex_char)
+                hex_string += hex_char
+            else:
+                raise SyntaxError("invalid unicode codepoint")
+                # return None
+        # optional 5th hex digit
+        hex_char = self.peek()
+        if hex_char is not None and hex_char in "0123456789ABCDEF":
+            self.m(hex_char)
             hex_string += hex_char
+        return ("UNICODE_CP", hex_string)
+
+    def char_class(self):
+        if self.peek() == '[':
+            self.m('[')
+            res = self.char_class_inner()
+            self.m(']')
+            return ("CHAR_CLASS", res)
+        return None
+
+    def char_class_inner(self):
+        tag = None
+        if self.peek() == '^':
+            self.m('^')
+            tag = "CHAR_CLASS_INNER_NEG"
         else:
-            raise SyntaxError("invalid unicode codepoint")
-            # return None
-    # optional 5th hex digit
-    hex_char = peek()
-    if hex_char in "0123456789ABCDEF":
-        m(hex_char)
-        hex_string += hex_char
-    return ("UNICODE_CP", hex_string)
-
-
-def char_class():
-    if peek() == '[':
-        m('[')
-        res = char_class_inner()
-        m(']')
-        return ("CHAR_CLASS", res)
-    return None
-
-
-def char_class_inner():
-    tag = None
-    if peek() == '^':
-        m('^')
-        tag = "CHAR_CLASS_INNER_NEG"
-    else:
-        tag = "CHAR_CLASS_INNER"
-    res = char_class_expr()
-    if res:
-        return (tag, res)
-    raise SyntaxError("invalid char class expression")
-
-
-'''
-left-recursive production
-CHAR_CLASS_EXPR -> CHAR_CLASS_EXPR EXTENDED_CHAR || CHAR_CLASS_EXPR CHAR_CLASS_RANGE || EXTENDED_CHAR || CHAR_CLASS_RANGE
-
-CHAR_CLASS_EXPR -> EXTENDED_CHAR CHAR_CLASS_EXPR' || CHAR_CLASS_RANGE CHAR_CLASS_EXPR'
-CHAR_CLASS_EXPR' -> CHAR_CLASS_EXPR CHAR_CLASS_EXPR' || ε
-'''
-
-
-def char_class_expr():
-    res = ()
-    while peek() is not None and peek() != ']':
-        if peek() == '-':
-            m('-')
-            res += (("RANGE", None),)
-        else:
-            r = extended_char()
-            if r:
-                res += (r,)
+            tag = "CHAR_CLASS_INNER"
+        res = self.char_class_expr()
+        if res:
+            return (tag, res)
+        raise SyntaxError("invalid char class expression")
+
+    '''
+    left-recursive production
+    CHAR_CLASS_EXPR -> CHAR_CLASS_EXPR EXTENDED_CHAR || CHAR_CLASS_EXPR CHAR_CLASS_RANGE || EXTENDED_CHAR || CHAR_CLASS_RANGE
+
+    CHAR_CLASS_EXPR -> EXTENDED_CHAR CHAR_CLASS_EXPR' || CHAR_CLASS_RANGE CHAR_CLASS_EXPR'
+    CHAR_CLASS_EXPR' -> CHAR_CLASS_EXPR CHAR_CLASS_EXPR' || ε
+    '''
+
+    def char_class_expr(self):
+        res = ()
+        while self.peek() is not None and self.peek() != ']':
+            if self.peek() == '-':
+                self.m('-')
+                res += (("RANGE", None),)
             else:
-                break
-    if res is not None:
-        return res
-    return None
-    # return ("CHAR_CLASS_EXPR", res)
+                r = self.extended_char()
+                if r:
+                    res += (r,)
+                else:
+                    break
+        if res is not None:
+            return res
+        return None
+        # return ("CHAR_CLASS_EXPR", res)
+
+
+def reverse(tree):
+    """
+    Returns the tree of the reversed expression, as lexed with reverse=True
+
+    e.g the tree of abc|def|g(hi)*j becomes that of cba|fed|j(ih)*g
+    """
+    if tree is None or type(tree) is not tuple:
+        return tree
+    k = tree[0]
+    if k == "UNION_EXPR":
+        return (k, tuple(map(reverse, tree[1])))
+    elif k == "ANCHORED_EXPR":
+        _, tag, kid = tree
+        tag = "".join('$' if a == '^' else '^' for a in tag)
+        return (k, tag, reverse(kid))
+    elif k == "CONCAT_EXPR":
+        return (k, tuple(map(reverse, tree[1]))[::-1])
+    elif k == "EXPR":
+        return (k, reverse(tree[1]))
+    # lookarounds swap directions, their inner exprs already run the right way
+    elif k == "LOOKAHEAD":
+        return ("LOOKBEHIND", tree[1])
+    elif k == "LOOKAHEAD_NEG":
+        return ("LOOKBEHIND_NEG", tree[1])
+    elif k == "LOOKBEHIND":
+        return ("LOOKAHEAD", tree[1])
+    elif k == "LOOKBEHIND_NEG":
+        return ("LOOKAHEAD_NEG", tree[1])
+    elif k in ("KLEENE", "LAZY_KLEENE", "MATCH", "LAZY_MATCH", "OPT", "LAZY_OPT") \
+            or type(k) is tuple:
+        # quantified exprs, incl. ranges
+        return (k, reverse(tree[1]))
+    # chars and char classes read the same both ways
+    return tree
 
 
 """
@@ -0,0 +1,249 @@
+
+"""
+Optimization pass over compiled programs, run after construction (see builder.Builder.freeze)
+
+Thompson construction wraps every subexpression in its own start and end states, linked by
+empty transitions, so that nested patterns end up with long chains of states doing nothing
+but being entered, and every one of them counts in the active set of a run. The pass:
+- eliminates empty transitions: only the states that are entered by consuming a char,
+  the start, final and tagged states and guarded states are kept, each taking over
+  the transitions of its closure (see program.State)
+- prunes the states that can't be reached from the start, or can't reach a final or tagged state
+- merges the states with the same guards and transitions to the same (merged) states,
+  by partition refinement
+
+Guards are left as they are: guarded states are kept, and are still entered through empty transitions
+"""
+from program import Program, State
+
+
+def optimize(prog):
+    """
+    Returns an optimized copy of the program, matching the same
+    """
+    states = prog.states
+    # states the runtime looks up in the active set
+    markers = {Program.END, *prog.tags}
+    kernel = {Program.START} | markers
+    for st in states:
+        for targets in st.chars.values():
+            kernel.update(targets)
+        kernel.update(to for _, to in st.preds)
+        kernel.update(st.gates)
+
+    # kernel state -> (chars, preds, eps, guards), the closure being
+    # the state itself and the markers in it, plus its gates
+    shape = {}
+    for state in kernel:
+        st = states[state]
+        chars = {}
+        preds = {}
+        for s in st.closure:
+            for c, targets in states[s].chars.items():
+                chars.setdefault(c, set()).update(targets)
+            for pred in states[s].preds:
+                preds[pred] = None
+        eps = [s for s in st.closure if s in markers and s != state] + list(st.gates)
+        shape[state] = (chars, list(preds), eps, st.guards)
+
+    edges = {state: _targets(shape[state]) for state in shape}
+    keep = _useful(edges, markers) | markers | {Program.START}
+    rep = _merge_equivalent(shape, edges, keep, markers)
+    return _renumber(prog, shape, edges, keep, rep)
+
+
+# returns the states reachable from the start that can reach a marker
+def _useful(edges, markers):
+    reached = {Program.START}
+    stack = [Program.START]
+    while stack:
+        for to in edges[stack.pop()]:
+            if to not in reached:
+                reached.add(to)
+                stack.append(to)
+    back = {}
+    for state in reached:
+        for to in edges[state]:
+            back.setdefault(to, []).append(state)
+    useful = set(markers & reached)
+    stack = list(useful)
+    while stack:
+        for fr in back.get(stack.pop(), ()):
+            if fr not in useful:
+                useful.add(fr)
+                stack.append(fr)
+    return useful
+
+
+# returns the states entered from a state's shape
+def _targets(shape):
+    chars, preds, eps, _ = shape
+    res = set(eps)
+    for targets in chars.values():
+        res.update(targets)
+    res.update(to for _, to in preds)
+    return res
+
+
+# returns state -> the state it's merged into (the least of those it's merged with), merging the states
+# with the same guards whose transitions lead to the same merged states on every label.
+# They're found by partition refinement: states start out in blocks of those with the same guards and labels
+# (markers each in their own), and blocks are split until the states of every block lead to the same blocks.
+# Each state's transitions are counted by (label, target block): only the counts of the transitions into
+# states moving to another block get updated, and only the states they come from get checked again.
+# The largest part of a split block stays in it, so that a state only moves a logarithmic number of times
+def _merge_equivalent(shape, edges, keep, markers):
+    # state -> its (label, target) transitions, and state -> the (state, label) transitions into it
+    out = {state: _labelled(shape[state], keep) for state in keep}
+    back = {state: [] for state in keep}
+    for state, labelled in out.items():
+        for label, to in labelled:
+            back[to].append((state, label))
+
+    blocks = []
+    block_of = {}
+    initial = {}
+    for state in sorted(keep):
+        key = (state if state in markers else None, tuple(map(id, shape[state][3])),
+               frozenset(label for label, _ in out[state]))
+        b = initial.get(key)
+        if b is None:
+            b = initial[key] = len(blocks)
+            blocks.append(set())
+        blocks[b].add(state)
+        block_of[state] = b
+
+    # state -> (label, target block) -> number of transitions, and the hash of its keys, updated along
+    counts = {}
+    hashes = {}
+    for state, labelled in out.items():
+        c = counts[state] = {}
+        for label, to in labelled:
+            key = (label, block_of[to])
+            c[key] = c.get(key, 0) + 1
+        hashes[state] = sum(map(hash, c)) & _MASK
+
+    # block -> its states whose counts changed since it was last split
+    dirty = {b: set(block) for b, block in enumerate(blocks) if len(block) > 1}
+    while dirty:
+        b, checked = dirty.popitem()
+        block = blocks[b]
+        # the states left unchanged all still lead to the same blocks,
+        # those checked that lead to the same blocks as them stay with them
+        first = next((state for state in block if state not in checked), None)
+        stay = []
+        # hash -> parts of the checked states leading to the same blocks
+        groups = {}
+        for state in checked:
+            keys = counts[state].keys()
+            if first is not None and hashes[state] == hashes[first] and keys == counts[first].keys():
+                stay.append(state)
+                continue
+            for part in groups.setdefault(hashes[state], []):
+                if counts[part[0]].keys() == keys:
+                    part.append(state)
+                    break
+            else:
+                groups[hashes[state]].append([state])
+        parts = [part for same in groups.values() for part in same]
+        if first is None:
+            largest = max(parts, key=len)
+        elif not parts:
+            continue
+        else:
+            # the part of the unchanged states is only listed if it moves
+            largest = max(parts, key=len)
+            if len(block) - len(checked) + len(stay) >= len(largest):
+                largest = None
+            else:
+                moving = set(state for part in parts for state in part)
+                parts.append([state for state in block if state not in moving])
+        if len(parts) == 1 and largest is not None:
+            continue
+        moved = []
+        for part in parts:
+            if part is largest:
+                continue
+            new = len(blocks)
+            blocks.append(set(part))
+            block.difference_update(part)
+            for state in part:
+                block_of[state] = new
+            moved += part
+        # update the counts of the transitions into the states that moved, once they all have
+        for state in moved:
+            new = block_of[state]
+            for fr, label in back[state]:
+                if len(blocks[block_of[fr]]) == 1:
+                    # states alone in their block never move again, their counts aren't needed anymore
+                    continue
+                c = counts[fr]
+                key = (label, b)
+                c[key] -= 1
+                if not c[key]:
+                    del c[key]
+                    hashes[fr] = (hashes[fr] - hash(key)) & _MASK
+                key = (label, new)
+                if key in c:
+                    c[key] += 1
+                else:
+                    c[key] = 1
+                    hashes[fr] = (hashes[fr] + hash(key)) & _MASK
+                dirty.setdefault(block_of[fr], set()).add(fr)
+    least = [min(block) if block else None for block in blocks]
+    return {state: least[block_of[state]] for state in keep}
+
+
+# hashes of count keys are summed modulo 2**64
+_MASK = (1 << 64) - 1
+
+
+# returns the (label, target) transitions of a state's shape into kept states,
+# labels being (0, char), (1, predicate) and (2,) for empty transitions
+def _labelled(shape, keep):
+    chars, preds, eps, _ = shape
+    res = set()
+    for c, targets in chars.items():
+        res.update(((0, c), to) for to in targets if to in keep)
+    res.update(((1, pred), to) for pred, to in preds if to in keep)
+    res.update(((2,), to) for to in eps if to in keep)
+    return res
+
+
+# returns the program made of the representatives of the kept states,
+# numbered in the order they're reached from the start, so that states used together are stored close together
+def _renumber(prog, shape, edges, keep, rep):
+    reps = {rep[state] for state in keep}
+    ids = {Program.START: Program.START, Program.END: Program.END}
+    order = [Program.START, Program.END]
+    queue = [Program.START]
+    while queue:
+        for to in sorted(edges[queue.pop()]):
+            if to in keep and rep[to] not in ids:
+                ids[rep[to]] = len(order)
+                order.append(rep[to])
+                queue.append(rep[to])
+    # tagged states that can't be reached still get numbered
+    for state in sorted(reps):
+        if state not in ids:
+            ids[state] = len(order)
+            order.append(state)
+
+    def new_id(state):
+        return ids[rep[state]]
+
+    states = []
+    for state in order:
+        chars, preds, eps, guards = shape[state]
+        new_chars = {}
+        for c, targets in chars.items():
+            targets = sorted({new_id(to) for to in targets if to in keep})
+            if targets:
+                new_chars[c] = tuple(targets)
+        new_preds = tuple(dict.fromkeys((pred, new_id(to)) for pred, to in preds if to in keep))
+        new_eps = tuple(dict.fromkeys(new_id(to) for to in eps if to in keep))
+        states.append(State(new_chars, new_preds, new_eps, guards))
+    res = Program(states)
+    res.tags = tuple(new_id(state) for state in prog.tags)
+    res.dfa_budget = prog.dfa_budget
+    return res
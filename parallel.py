@@ -0,0 +1,201 @@
+
+"""
+Scanning a single large input in parallel, with a pool of worker processes
+
+The input is split into chunks, each scanned by a worker along with the context guards read around it
+(see analysis.reach), and the workers' results are stitched together chunk to chunk by the caller.
+
+For overlapping matches, workers return the matches starting in their chunk, scanning on past it for as long
+as such matches may go on, if that's bounded. Otherwise, they return the threads still running at the end
+of what they were given, which the caller carries on over the next chunk's span, along with that chunk's own,
+until they die out.
+
+For leftmost-longest matches, workers run the search from the start of their chunk to its end, as if no
+match were in progress there, and return its matches and the state it's left in. The caller carries the
+search on over the next chunk itself while the one it ran through the previous chunks is still in progress,
+until it finds a match the worker found too: from then on, both searches are the same, so the worker's
+matches are taken as they are. Either way, no part of the input is searched by the caller more than once.
+
+Many inputs are matched in parallel the other way round, in batches of whole inputs (see map_batches)
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import pikevm
+import program
+import regex
+
+# inputs shorter than this are scanned serially
+MIN_PARALLEL_SIZE = 1 << 16
+# for patterns whose matches are unbounded, workers scan on past their chunk
+# for 1/_SLACK of its size before handing the threads still running back
+_SLACK = 8
+
+# the compiled pattern, per worker process
+_regex = None
+
+
+def init_worker(data):
+    """
+    Initializer of worker processes, given the compiled pattern as bytes (see Regex.dumps):
+    workers are sent the compiled pattern, rather than compiling it again each
+    """
+    global _regex
+    _regex = regex.loads(data)
+
+
+def worker_regex():
+    """
+    Returns the compiled pattern of the current worker process (see init_worker)
+    """
+    return _regex
+
+
+def scan(reg, input, workers=None, overlapped=True, chunk_size=None):
+    """
+    Scans the input as reg.scan(input, overlapped=overlapped) does, split into chunks
+    of chunk_size (by default, a few per worker) scanned by a pool of workers processes
+
+    Inputs too small to be worth it, and patterns with lookarounds of unbounded length, are scanned serially
+    """
+    behind, ahead = reg.reach
+    input_len = len(input)
+    if workers is None:
+        workers = os.cpu_count()
+    if workers <= 1 or input_len < MIN_PARALLEL_SIZE or behind is None or ahead is None:
+        return reg.scan(input, overlapped=overlapped)
+    if reg._rejects(input):
+        return []
+    if chunk_size is None:
+        chunk_size = -(-input_len // (workers * 4))
+
+    max_len = reg.max_len
+    # how far past its chunk a worker scans, for overlapping matches
+    extra = 0
+    if overlapped:
+        extra = max_len if max_len is not None else chunk_size // _SLACK
+    chunks = []
+    jobs = []
+    for begin in range(0, input_len, chunk_size):
+        end = min(begin + chunk_size, input_len)
+        stop = min(end + extra, input_len)
+        lo = max(begin - behind, 0)
+        window = input[lo:min(stop + ahead, input_len)]
+        if isinstance(window, memoryview):
+            # memoryviews can't be sent to workers
+            window = window.tobytes()
+        chunks.append((begin, end, stop))
+        jobs.append((window, lo, begin, end, stop, overlapped, stop + ahead >= input_len))
+
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(reg.dumps(),)) as pool:
+        results = list(pool.map(_scan_chunk, *zip(*jobs)))
+
+    if overlapped:
+        return _stitch_overlapping(reg, input, chunks, results)
+    return _stitch_leftmost_longest(reg, input, chunks, results)
+
+
+# scans window, which starts at pos lo of the whole input, for the matches starting in [begin, end),
+# with positions in the whole input. If overlapped, scans up to pos stop and returns (matches, pos, threads)
+# as pikevm.overlapping_from does. Otherwise, returns (matches, (pos, threads, best)), the matches and state
+# of a leftmost-longest search (see pikevm.LeftmostLongest) started afresh at begin and run up to end,
+# or to the end of the input if the window reaches it (final)
+def _scan_chunk(window, lo, begin, end, stop, overlapped, final):
+    reg = _regex
+    if not overlapped:
+        search = pikevm.LeftmostLongest(reg.fa, *reg.reach, prefilter=reg._prefilter(window))
+        search.pos = begin
+        matches = search.feed(window, lo, final)
+        return matches, (search.pos, search.threads, search.best)
+    # literals can only be looked for if matches are within the window
+    prefilter = reg._prefilter(window) if reg.max_len is not None else None
+    matches, pos, threads = pikevm.overlapping_from(
+        reg.fa, window, begin - lo, end - lo, stop - lo, prefilter=prefilter)
+    return [(i + lo, j + lo) for i, j in matches], pos + lo, threads
+
+
+# merges the overlapping matches of every chunk, carrying the threads left running at the end
+# of a chunk's span over the next one's, merged with those it leaves running, and so on
+def _stitch_overlapping(reg, input, chunks, results):
+    matches = []
+    # threads carried over, at pos
+    threads = {}
+    pos = 0
+    flags = None
+    for (_, _, stop), (chunk_matches, chunk_pos, chunk_threads) in zip(chunks, results):
+        matches += chunk_matches
+        if threads:
+            if flags is None:
+                # shared, so that lookaround tables are only built once
+                flags = program.new_flags(input)
+            carried, pos, threads = pikevm.overlapping_from(
+                reg.fa, input, pos, pos, stop, threads=threads, flags=flags)
+            matches += carried
+        if chunk_threads:
+            if threads:
+                # both are at stop, starts of threads in the same state are merged
+                for state, mask in chunk_threads.items():
+                    threads[state] = threads.get(state, 0) | mask
+            else:
+                threads = dict(chunk_threads)
+            pos = chunk_pos
+    matches.sort()
+    return matches
+
+
+# merges the leftmost-longest matches of every chunk, carrying the search on over a chunk
+# until it's in step with the worker's (see the module's docstring)
+def _stitch_leftmost_longest(reg, input, chunks, results):
+    behind, ahead = reg.reach
+    input_len = len(input)
+    search = pikevm.LeftmostLongest(reg.fa, behind, ahead)
+    matches = []
+    for (begin, end, _), (chunk_matches, state) in zip(chunks, results):
+        if search.pos >= end:
+            # the search has already been run over the chunk
+            continue
+        if search.pos == begin and not search.threads and search.best is None:
+            # nothing in progress, the worker's search is the same
+            matches += chunk_matches
+            search.pos, search.threads, search.best = state
+            continue
+        # the search reads on from its pos, or from the end of its best match once that's final,
+        # and guards behind it: the input before can be left out
+        lo = search.pos if search.best is None else search.best[1]
+        lo = max(lo - behind, 0)
+        window = input[lo:min(end + ahead, input_len)]
+        search.prefilter = reg._prefilter(window)
+        final = end + ahead >= input_len
+        found = {match: k for k, match in enumerate(chunk_matches)}
+        while True:
+            first = search.feed(window, lo, final, first=True)
+            if not first:
+                # the end of the chunk was reached
+                break
+            matches += first
+            k = found.get(first[0])
+            if k is not None:
+                # in step with the worker's search from there on
+                matches += chunk_matches[k + 1:]
+                search.pos, search.threads, search.best = state
+                break
+    return matches
+
+
+def map_batches(reg, method, inputs, workers, batch_size=None, **options):
+    """
+    Splits the inputs into batches of batch_size (by default, a few per worker), runs
+    reg.<method>(batch, **options) on each in a pool of workers processes, and returns
+    the results in order, as (index of the first input of the batch, result) pairs
+    """
+    inputs = list(inputs)
+    if batch_size is None:
+        batch_size = max(-(-len(inputs) // (workers * 4)), 1)
+    offsets = range(0, len(inputs), batch_size)
+    batches = [inputs[offset:offset + batch_size] for offset in offsets]
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(reg.dumps(),)) as pool:
+        results = pool.map(_run_batch, [method] * len(batches), batches, [options] * len(batches))
+        return list(zip(offsets, results))
+
+
+def _run_batch(method, batch, options):
+    return getattr(_regex, method)(batch, **options)
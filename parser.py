@@ -1,37 +1,101 @@
-from nfa import NFA
+from builder import Builder
+from charset import CharSet
+from guards import Anchor, Lookaround
+import charset
+import lexer
 
 # FIXME: clean this up
 
+# max number of states the copies of a range quantifier's expr may add up to
+MAX_REPETITION_STATES = 1 << 16
 
-def parse(tree):
-    if tree[0] == "UNION_EXPR":
-        return union_expr(tree[1])
+
+def parse(tree, b):
+    """
+    Builds the automaton of a tree (see lexer.lex) in the builder, and returns its fragment (see builder.Builder)
+    """
+    if tree is not None and tree[0] == "UNION_EXPR":
+        return union_expr(tree[1], b)
     raise SyntaxError("expected a union expression at the root")
 
 
-def union_expr(kids):
+def compile(tree):
+    """
+    Returns the program of a tree (see lexer.lex), built in a builder of its own
+    """
+    b = Builder()
+    return b.freeze(parse(tree, b))
+
+
+def union_expr(kids, b):
     if kids is None or type(kids) is not tuple:
         return None
 
+    literals = [literal(kid) for kid in kids]
+    if len(kids) > 1 and all(literals):
+        return literal_union(literals, b)
+
     union = []
 
     for kid in kids:
         k = kid[0]
         if k == "CONCAT_EXPR":
-            r = concat_expr(kid[1])
+            r = concat_expr(kid[1], b)
         elif k == "ANCHORED_EXPR":
             k, anchor_type, v = kid
-            r = anchored_expr(v, anchor_type)
+            r = anchored_expr(v, anchor_type, b)
         else:
             raise SyntaxError("expected ANCHORED_EXPR")
 
         if r is not None:
             union.append(r)
 
-    return union[0] | union[1:] if len(union) > 1 else union[0]
+    return b.union(union) if len(union) > 1 else union[0]
+
+
+def literal(kid):
+    """
+    Returns the string a CONCAT_EXPR of plain chars matches, or None if it's not one
+    """
+    if kid is None or type(kid) is not tuple or kid[0] != "CONCAT_EXPR":
+        return None
+    res = ""
+    for k, v in kid[1]:
+        if k != "EXPR":
+            return None
+        if v[0] == "EXTENDED_CHAR":
+            c = extended_char(v[1]).single()
+        elif v[0] == "CHAR_CLASS":
+            c = char_class(v[1]).single()
+        else:
+            return None
+        if c is None:
+            return None
+        res += c
+    return res
 
 
-def anchored_expr(kid, anchor_type):
+def literal_union(literals, b):
+    # build a union of literals as a trie, rather than a branch per literal,
+    # so that a step on a char is a single transition however many literals there are
+    # (with the start state added back in at every pos, as scans do, this runs as an Aho-Corasick automaton)
+    start = b.state()
+    end = b.state()
+    # (state, char) -> state
+    trie = {}
+    for lit in literals:
+        state = start
+        for c in lit:
+            nxt = trie.get((state, c))
+            if nxt is None:
+                nxt = trie[(state, c)] = b.state()
+                b.add_transition(state, c, nxt)
+            state = nxt
+        b.add_transition(state, None, end)
+    return b.fragment(start, end, start)
+
+
+def anchored_expr(kid, anchor_type, b):
     if kid is None or type(kid) is not tuple:
         return None
     k, v = kid
@@ -39,30 +103,20 @@ def anchored_expr(kid, anchor_type):
     if k != "CONCAT_EXPR":
         raise SyntaxError("expected CONCAT_EXPR in ANCHORED_EXPR")
 
-    concat_list = [concat_expr(v)]
+    concat_list = [concat_expr(v, b)]
 
     if '^' in anchor_type:
-        start = NFA()
-        start.add_transition(NFA.START, None, NFA.END)
-        # guard: at the start of input or after a newline
-        start.add_guard(
-            NFA.START, lambda f: f['pos'] <= 0 or f["input"][f['pos'] - 1] == '\n')
-        concat_list = [start] + concat_list
+        concat_list = [b.guard(Anchor('^'))] + concat_list
 
     if '$' in anchor_type:
-        end = NFA()
-        end.add_transition(NFA.START, None, NFA.END)
-        # guard: at the end of input or before a newline
-        end.add_guard(
-            NFA.START, lambda f: f['pos'] == f["input_len"] - 1 or f["input"][f['pos'] + 1] == '\n')
-        concat_list += [end]
+        concat_list += [b.guard(Anchor('$'))]
 
     if len(concat_list) > 1:
-        return concat_list[0] & concat_list[1:]
+        return b.concat(concat_list)
     return concat_list[0]
 
 
-def concat_expr(kids):
+def concat_expr(kids, b):
     if kids is None or type(kids) is not tuple:
         return None
 
@@ -74,106 +128,77 @@ def concat_expr(kids):
         k, v = kid
         r = None
         if k == "EXPR":
-            r = expr(v)
+            r = expr(v, b)
         elif k == "KLEENE":
-            r = kleene(v)
+            r = kleene(v, b)
         elif k == "MATCH":
-            r = matchop(v)
+            r = matchop(v, b)
         elif k == "OPT":
-            r = opt(v)
+            r = opt(v, b)
         elif type(k) is tuple and k[0] == "RANGE":
-            r = range_qf(kid)
-        # FIXME: lookaheads and lookbehinds don't currently work if the fa is later kleenefied etc.
-        elif k == "LOOKAHEAD" or k == "LOOKAHEAD_NEG":
-            is_neg = k == "LOOKAHEAD_NEG"
-            k, lookahead_tree = v
-            if k != "UNION_EXPR":
-                raise SyntaxError(f"expected UNION_EXPR in lookahead")
-            la_fa = union_expr(lookahead_tree)
-
-            # run the lookbehind fa against the input ahead of the current pos
-            def lookahead_guard(f):
-                pos = f["pos"]
-                input = f["input"]
-                inlen = f["input_len"]
-                if pos + 1 > inlen:
-                    return is_neg
-                res = la_fa.process(input, pos+1, inlen, short_circuit=True)
-                return (is_neg and not res) or (not is_neg and res)
-
-            # if the expr is successfully matched, check if the lookahead is satisfied
-            r = NFA()
-            r.add_transition(NFA.START, None, NFA.END)
-            r.add_guard(NFA.START, lookahead_guard)
-
-        elif k == "LOOKBEHIND" or k == "LOOKBEHIND_NEG":
-            is_neg = k == "LOOKBEHIND_NEG"
-            # the lookbehind expr is inverted by the lexer
-            k, lookbehind_tree = v
-            if k != "UNION_EXPR":
-                raise SyntaxError(f"expected UNION_EXPR in lookbehind")
-            lb_fa = union_expr(lookbehind_tree)
-
-            # run the lookbehind fa against the reverse of the input before the current
-            def lookbehind_guard(f):
-                pos = f["pos"]
-                input = f["input"][pos::-1]
-                if len(input) < pos + 1:
-                    return is_neg
-                res = lb_fa.process(input, 0, pos+1, short_circuit=True)
-                return (is_neg and not res) or (not is_neg and res)
-
-            # before the expr is tested, check if the lookbehind is satisfied
-            r = NFA()
-            r.add_transition(NFA.START, None, NFA.END)
-            r.add_guard(NFA.START, lookbehind_guard)
-
+            r = range_qf(kid, b)
+        elif k in ("LOOKAHEAD", "LOOKAHEAD_NEG", "LOOKBEHIND", "LOOKBEHIND_NEG"):
+            r = lookaround(k, v, b)
         else:
             raise SyntaxError(f"unknown expression found in CONCAT_EXPR: {k}")
 
         if r is not None:
             concat.append(r)
 
-    return concat[0] & concat[1:] if len(concat) > 1 else concat[0]
+    return b.concat(concat) if len(concat) > 1 else concat[0]
 
 
-def kleene(kid):
+def lookaround(kind, kid, b):
+    if kid is None or type(kid) is not tuple:
+        return None
+    k, v = kid
+    if k != "UNION_EXPR":
+        raise SyntaxError("expected UNION_EXPR in lookaround")
+    # the lookaround is checked by running it over the input in the opposite direction
+    # to the pos it's checked at, i.e lookaheads backwards and lookbehinds forwards
+    # (lookbehinds are already inverted by the lexer)
+    # (the lookaround's program is built in a builder of its own)
+    fa = compile(lexer.reverse(kid))
+    return b.guard(Lookaround(fa, kind.startswith("LOOKAHEAD"), kind.endswith("_NEG")))
+
+
+def kleene(kid, b):
     if kid is None or type(kid) is not tuple:
         return None
     k, v = kid
     if k != "EXPR":
         raise SyntaxError("expected EXPR in kleene")
-    res = expr(v)
+    res = expr(v, b)
     if res != None:
-        return res.kleenefy()
+        return b.star(res)
     return None
 
 
-def matchop(kid):
+def matchop(kid, b):
     if kid is None or type(kid) is not tuple:
         return None
     k, v = kid
     if k != "EXPR":
         raise SyntaxError("expected EXPR in kleene")
-    res = expr(v)
+    res = expr(v, b)
     if res != None:
-        return res.matchify()
+        return b.plus(res)
     return None
 
 
-def opt(kid):
+def opt(kid, b):
     if kid is None or type(kid) is not tuple:
         return None
     k, v = kid
     if k != "EXPR":
         raise SyntaxError("expected EXPR in opt")
-    res = expr(v)
+    res = expr(v, b)
     if res != None:
-        return res.optify()
+        return b.opt(res)
     return None
 
 
-def range_qf(kid):
+def range_qf(kid, b):
     # TODO: clean this up
     if kid is None or type(kid) is not tuple:
         return None
@@ -188,9 +213,12 @@ def range_qf(kid):
     if expr_tag != "EXPR":
         raise SyntaxError("expected EXPR in range quantifier")
 
-    res = expr(expr_inner)
+    res = expr(expr_inner, b)
     if res is None:
         return None
+    # the largest bound is last, each repetition takes a copy of expr
+    if type(v[-1]) is int and v[-1] * num_states(res) > MAX_REPETITION_STATES:
+        raise SyntaxError("range quantifier too large")
 
     range_type = v[0]
     if range_type == "N" and len(v) == 2:
@@ -198,7 +226,7 @@ def range_qf(kid):
         n = v[1]
         # match an n-len run of expr
         if n > 1:
-            return res & [res for _ in range(n-1)]
+            return b.concat([res] + [b.copy(res) for _ in range(n-1)])
         elif n == 1:
             return res
         elif n == 0:
@@ -210,62 +238,59 @@ def range_qf(kid):
         n = v[1]
         if n > 1:
             # match an n-len run of exprs, followed by expr*
-            concat = [res] * (n-1) + [res.kleenefy()]
-            return res & concat
+            concat = [b.copy(res) for _ in range(n-1)] + [b.star(b.copy(res))]
+            return b.concat([res] + concat)
         elif n == 1:
             # match expr atleast once
-            return res.matchify()
+            return b.plus(res)
         elif n == 0:
             # basically the kleene star op
-            return res.kleenefy()
+            return b.star(res)
         else:
             raise SyntaxError("invalid bound in range quantifier")
     elif range_type == ",N" and len(v) == 2:
         # range is of type {,n} (eq. to {0,n})
-        return range_qf_n_m(0, v[1], res)
+        return range_qf_n_m(0, v[1], res, b)
     elif range_type == "N,N" and len(v) == 3:
         # range is of type {n,m}
-        return range_qf_n_m(v[1], v[2], res)
+        return range_qf_n_m(v[1], v[2], res, b)
     else:
         raise SyntaxError("unknown bound type in range quantifier")
 
 
-def range_qf_n_m(n, m, expr_fa):
+def range_qf_n_m(n, m, frag, b):
     if not (n >= 0 and m >= 0 and m >= n):
         raise SyntaxError("invalid bounds in range quantifier")
     if m == 0:
         # skip if upper bound is 0
         return None
-    union = []
-    for run_len in range(n, m+1):
-        if run_len > 1:
-            union.append(expr_fa & [expr_fa] * (run_len - 1))
-        elif run_len == 1:
-            union.append(expr_fa)
-        else:  # run_len is 0
-            fallthrough = NFA()
-            fallthrough.add_transition(NFA.START, None, NFA.END)
-            union.append(fallthrough)
-    return union[0] | union[1:] if len(union) > 1 else union[0]
-
-
-def expr(kid):
+    return b.repeat(frag, n, m)
+
+
+def num_states(frag):
+    """
+    Returns the number of states of a fragment (see builder.Fragment)
+    """
+    return frag.hi - frag.lo
+
+
+def expr(kid, b):
     if kid is None or type(kid) is not tuple:
         return None
     k, v = kid
 
-    def make_nfa(pred):
-        a = NFA()
-        a.add_transition(NFA.START, pred, NFA.END)
-        return a
+    def make_fragment(chars):
+        # single chars are looked up directly, other sets are tested as predicates
+        c = chars.single()
+        return b.char(c if c is not None else chars)
 
     res = None
     if k == "EXTENDED_CHAR":
-        res = make_nfa(extended_char(v))
+        res = make_fragment(extended_char(v))
     elif k == "CHAR_CLASS":
-        res = make_nfa(char_class(v))
+        res = make_fragment(char_class(v))
     elif k == "UNION_EXPR":
-        res = union_expr(v)
+        res = union_expr(v, b)
     return res
 
 
@@ -280,21 +305,10 @@ def char_class(kid):
     elif kid[0] != "CHAR_CLASS_INNER":
         raise SyntaxError("invalid char class type")
 
-    # print("emitting char_class, is_neg:", is_neg)
-
-    # get tuple of lambdas to test against
-    lambdas = char_class_expr(kid[1])
-
-    def char_class_helper(x):
-        res = False
-        for test in lambdas:
-            res = res or test(x)
-            if not is_neg and res:  # short-circuit if not complementary
-                return True
-        return is_neg and not res
-
-    # return lambda that tests for at least one match
-    return char_class_helper
+    # merge the members into a single set, complementing it if need be
+    res = CharSet(r for chars in char_class_expr(kid[1])
+                  for r in chars.ranges)
+    return ~res if is_neg else res
 
 
 def char_class_expr(kids):
@@ -342,10 +356,7 @@ def extended_char_range(start, end):
     if end < start:
         raise SyntaxError("invalid bounds in char range")
 
-    def extended_char_range_helper(x):
-        return start <= x and x <= end
-
-    return extended_char_range_helper
+    return CharSet.between(start, end)
 
 
 def extended_char(kid):
@@ -354,44 +365,44 @@ def extended_char(kid):
     k, v = kid
     # print("emitting extended_char", k, v)
     if k == "CHAR":
-        return lambda x: x == v
+        return CharSet.of(v)
     elif k == "WILDCARD":
-        return lambda x: x != '\n'
+        return charset.WILDCARD
     elif k == "ASCII_CP":
-        return lambda x: ord(x) == int(v, 16)
+        return CharSet.of(chr(int(v, 16)))
     elif k == "UNICODE_CP":
-        return lambda x: ord(x) == int(v, 16)
+        return CharSet.of(chr(int(v, 16)))
     elif k == "SPECIAL_CHAR":
         if v == "d":
-            return lambda x: x.isdigit()
+            return charset.digits()
         elif v == "D":
-            return lambda x: x.isdigit() == False
+            return ~charset.digits()
         elif v == "w":
-            return lambda x: x.isalnum()
+            return charset.alphanums()
         elif v == "W":
-            return lambda x: x.isalnum() == False
+            return ~charset.alphanums()
         elif v == "s":
-            return lambda x: x.isspace()
+            return charset.spaces()
         elif v == "S":
-            return lambda x: x.isspace() == False
+            return ~charset.spaces()
         elif v == "t":
-            return lambda x: x == '\t'
+            return CharSet.of('\t')
         elif v == "r":
-            return lambda x: x == '\r'
+            return CharSet.of('\r')
         elif v == "n":
-            return lambda x: x == '\n'
+            return CharSet.of('\n')
         elif v == "v":
-            return lambda x: x == '\v'
+            return CharSet.of('\v')
         elif v == "f":
-            return lambda x: x == '\f'
+            return CharSet.of('\f')
         elif v == "0":
-            return lambda x: x == '\0'
+            return CharSet.of('\0')
         else:
             raise SyntaxError("invalid special char")
     elif k == "DOLLAR":
-        return lambda x: x == '\n'
+        return CharSet.of('\n')
     elif k == "CARET":
-        return lambda x: x == '\x02'  # STX, FIXME
+        return CharSet.of('\x02')  # STX, FIXME
     else:
         raise SyntaxError("invalid extended char")
 
@@ -402,8 +413,7 @@ if __name__ == "__main__":
     regex = input("Enter pattern: ")
     regex = regex if regex != "" else r"\[{,3}\??[hc2-4g-\x707-9]{0,3}(a|t)*(he+llo)*|.\++|(\u1f60B|எழுத்து)*"
     tree = lexer.lex(regex)
-    lexer.set_reverse(True)
-    tree_rev = lexer.lex(regex)
+    tree_rev = lexer.lex(regex, reverse=True)
     pprint(tree)
     pprint(tree_rev)
     fa = parse(tree)
@@ -0,0 +1,321 @@
+
+"""
+Match finding over a Program, in a single forward pass over the input
+
+Both searches run every thread of the automaton in lockstep (a Pike VM),
+each thread remembering where its match started.
+Guards are checked with flags["pos"] set to the index of the last char consumed,
+i.e one behind the position being tested
+"""
+import program
+
+
+def leftmost_longest(prog, input, prefilter=None, stats=None):
+    """
+    Returns the non-overlapping leftmost-longest (non-empty) matches of prog in input,
+    as a list of (start, end) intervals
+
+    If given, the prefilter is asked where matches may start (see prefilter.py),
+    and stats counts the steps taken (see stats.py)
+    """
+    return LeftmostLongest(prog, prefilter=prefilter, stats=stats).feed(input)
+
+
+class LeftmostLongest:
+    """
+    A leftmost-longest search that can be fed the input a piece at a time
+
+    Threads carry the earliest start they can be reached from, so the first thread
+    to reach a state wins it. Once a match is found, no new threads are started
+    and those started after it are dropped; the match is final once the threads
+    that could still extend it (or start before it) have died out
+    """
+
+    def __init__(self, prog, behind=0, ahead=0, prefilter=None, stats=None):
+        self.prog = prog
+        # counts the steps taken, if given (see stats.py)
+        self.stats = stats
+        # skips to where matches may start when no match is in progress
+        self.prefilter = prefilter
+        # how many chars guards may read behind and ahead of the pos they're checked at
+        self.behind = behind
+        self.ahead = ahead
+        # pos in the whole input the search is at
+        self.pos = 0
+        # state -> start of the thread in it, ordered by start
+        self.threads = {}
+        # best match found so far, if any
+        self.best = None
+
+    def reset(self):
+        """
+        Reset the search to the start of a new input
+        """
+        self.pos = 0
+        self.threads = {}
+        self.best = None
+
+    def keep_from(self):
+        """
+        Returns the pos in the whole input from which on it must still be fed
+        """
+        res = self.pos
+        if self.best is not None:
+            res = min(res, self.best[0])
+        if self.threads:
+            # threads are ordered by start
+            res = min(res, next(iter(self.threads.values())))
+        return max(res - self.behind, 0)
+
+    def feed(self, input, offset=0, final=True, first=False):
+        """
+        Runs the search as far as possible on input, which starts at pos offset of the whole input,
+        and returns the matches that are final, as (start, end) intervals in the whole input
+
+        input must start at or before keep_from(), and unless final, is expected to be followed
+        by more input in the next call. If first, the search stops at the first match
+        """
+        prog = self.prog
+        states = prog.states
+        flags = program.new_flags(input)
+        input_len = flags["input_len"]
+        start_state = states[prog.START]
+        end = prog.END
+        # chars only get consumed once the guards checked after them can see far enough ahead
+        limit = input_len if final else input_len - self.ahead
+
+        matches = []
+        pos = self.pos - offset
+        threads = self.threads
+        best = self.best
+        prefilter = self.prefilter
+        stats = self.stats
+        while final or pos < limit:
+            if best is None and not threads and prefilter is not None:
+                # nothing in progress, skip to where the next match may start
+                pos = prefilter.candidate(input, pos, final)
+                if pos < 0:
+                    pos = input_len
+                    break
+                if not final and pos >= limit:
+                    pos = limit
+                    break
+            if best is None:
+                # start a new thread here
+                flags["pos"] = pos - 1
+                _add(prog, flags, threads, start_state, prog.START, pos + offset, {})
+            if end in threads:
+                start = threads[end]
+                if start < pos + offset and (best is None or start < best[0] or
+                                             (start == best[0] and pos + offset > best[1])):
+                    best = (start, pos + offset)
+                    if stats is not None:
+                        stats.candidates += 1
+            if best is not None:
+                # threads started after the match can't beat it
+                threads = {s: start for s, start in threads.items()
+                           if start <= best[0]}
+            if pos == input_len or not threads and best is not None:
+                if best is None:
+                    break
+                matches.append(best)
+                # resume right after the match
+                pos = best[1] - offset
+                threads = {}
+                best = None
+                if first:
+                    break
+                continue
+
+            # step all threads over the next char
+            if stats is not None:
+                stats.step(len(threads))
+            flags["pos"] = pos
+            c = input[pos]
+            new_threads = {}
+            checked = {}
+            for state, start in threads.items():
+                st = states[state]
+                targets = st.chars.get(c)
+                if targets is not None:
+                    for to_state in targets:
+                        if to_state not in new_threads:
+                            _add(prog, flags, new_threads, states[to_state],
+                                 to_state, start, checked)
+                for pred, to_state in st.preds:
+                    if to_state not in new_threads and pred(c):
+                        _add(prog, flags, new_threads, states[to_state],
+                             to_state, start, checked)
+            threads = new_threads
+            pos += 1
+
+        self.pos = pos + offset
+        self.threads = threads
+        self.best = best
+        return matches
+
+
+# add the closure of a state entered by a thread started at start,
+# checked is a memo of guard results at the current position
+def _add(prog, flags, threads, st, state, start, checked):
+    if st.guards and not _check(prog, flags, state, checked):
+        return
+    for s in st.closure:
+        if s not in threads:
+            threads[s] = start
+    for gate in st.gates:
+        if gate not in threads:
+            _add(prog, flags, threads, prog.states[gate], gate, start, checked)
+
+
+def _check(prog, flags, state, checked):
+    res = checked.get(state)
+    if res is None:
+        res = checked[state] = prog.check_guard(state, flags)
+    return res
+
+
+def overlapping(prog, input, prefilter=None, out=None, prefix=(), stats=None):
+    """
+    Returns every (non-empty) substring of input matched by prog, overlapping or not,
+    as a list of (start, end) intervals ordered by start then end
+
+    If given, the prefilter is asked where matches may start (see prefilter.py),
+    and stats counts the steps taken (see stats.py).
+    If out is given, the intervals are appended to it, each after prefix, and out is returned
+    """
+    end = prog.END
+    matches = [] if out is None else out
+    first = len(matches)
+    for pos, threads in _overlapping_threads(prog, input, prefilter, stats=stats):
+        _append_starts(matches, threads.get(end, 0), pos, prefix)
+    if stats is not None:
+        stats.candidates += len(matches) - first
+    matches[first:] = sorted(matches[first:])
+    return matches
+
+
+def overlapping_tagged(prog, input):
+    """
+    Returns every (non-empty) substring of input matched by prog, reaching any of its tagged states,
+    as a list of (tag index, start, end) ordered by start, end then tag index
+    """
+    tags = prog.tags
+    matches = []
+    for pos, threads in _overlapping_threads(prog, input):
+        for k, state in enumerate(tags):
+            mask = threads.get(state)
+            if mask:
+                _append_starts(matches, mask, pos, (k,))
+    matches.sort(key=lambda m: (m[1], m[2], m[0]))
+    return matches
+
+
+# append the intervals ending at pos of the starts in mask, after the given prefix
+def _append_starts(matches, mask, pos, prefix):
+    # bit 0 is the empty match
+    starts = mask >> 1
+    k = 1
+    while starts:
+        if starts & 1:
+            matches.append(prefix + (pos - k, pos))
+        starts >>= 1
+        k += 1
+
+
+def overlapping_from(prog, input, begin, end, stop=None, threads=None, prefilter=None, flags=None):
+    """
+    Runs an overlapping search (see overlapping) over input from pos begin, only starting
+    new threads before pos end, and stopping at pos stop if given (or once no threads are left).
+    threads are those left running by a previous run, at pos begin.
+    Returns (matches, pos, threads), with matches the unsorted (start, end) intervals found,
+    and threads those still running at pos, where the run stopped.
+    Matches ending at begin aren't returned, as they're the previous run's
+
+    Used to scan an input a piece at a time (see parallel.py)
+    """
+    if stop is None:
+        stop = len(input)
+    matches = []
+    pos = begin
+    if threads is None:
+        threads = {}
+    for pos, threads in _overlapping_threads(prog, input, prefilter, begin, end, stop, threads, flags):
+        if pos > begin:
+            _append_starts(matches, threads.get(prog.END, 0), pos, ())
+    if pos != stop:
+        # the run ended before stop, for lack of threads
+        return matches, pos, {}
+    return matches, pos, threads
+
+
+# yields (pos, threads) for every pos of the input from begin on, with threads mapping every state
+# reached at pos to the bitmask of the starts it can be reached from:
+# bit k stands for a thread started k chars ago.
+# New threads are only started before pos end (if given), and the run stops at pos stop (if given),
+# or once there are no threads left to run.
+# Positions the prefilter skips (with no threads) are left out. stats counts the steps taken, if given
+def _overlapping_threads(prog, input, prefilter=None, begin=0, end=None, stop=None, threads=None, flags=None,
+                         stats=None):
+    states = prog.states
+    if flags is None:
+        flags = program.new_flags(input)
+    input_len = flags["input_len"]
+    start_state = states[prog.START]
+    if end is None:
+        end = input_len + 1
+    if stop is None:
+        stop = input_len
+
+    # state -> bitmask of starts
+    if threads is None:
+        threads = {}
+    pos = begin
+    while pos <= stop:
+        if pos < end:
+            if not threads and prefilter is not None:
+                # nothing in progress, skip to where the next match may start
+                pos = prefilter.candidate(input, pos)
+                if pos < 0 or pos >= end:
+                    return
+            flags["pos"] = pos - 1
+            _merge(prog, flags, threads, start_state, prog.START, 1, {})
+        elif not threads:
+            return
+        yield pos, threads
+        if pos == stop:
+            break
+
+        if stats is not None:
+            stats.step(len(threads))
+        flags["pos"] = pos
+        c = input[pos]
+        new_threads = {}
+        checked = {}
+        for state, mask in threads.items():
+            st = states[state]
+            mask <<= 1
+            targets = st.chars.get(c)
+            if targets is not None:
+                for to_state in targets:
+                    _merge(prog, flags, new_threads, states[to_state],
+                           to_state, mask, checked)
+            for pred, to_state in st.preds:
+                if pred(c):
+                    _merge(prog, flags, new_threads, states[to_state],
+                           to_state, mask, checked)
+        threads = new_threads
+        pos += 1
+
+
+# like _add, but merging the starts of threads reaching the same state
+def _merge(prog, flags, threads, st, state, mask, checked):
+    if st.guards and not _check(prog, flags, state, checked):
+        return
+    get = threads.get
+    for s in st.closure:
+        threads[s] = get(s, 0) | mask
+    for gate in st.gates:
+        # skip gates that already have these starts, so that loops end
+        if get(gate, 0) | mask != get(gate, 0):
+            _merge(prog, flags, threads, prog.states[gate], gate, mask, checked)
@@ -0,0 +1,120 @@
+
+"""
+Prefilters, skipping over the parts of the input no match can start in
+
+A search only asks its prefilter where to go next when it has no match in progress,
+so that the automaton only runs around candidate positions.
+Prefilters look for literals every match contains one of (see analysis.required_literals),
+starting at most lead chars after the start of the match. If lead is None, they can only tell
+if there's a match ahead at all
+"""
+
+
+def of(literals, lead):
+    """
+    Returns a prefilter looking for the given literals
+    """
+    if len(literals) == 1:
+        return Literal(literals[0], lead)
+    return AhoCorasick(literals, lead)
+
+
+class Literal:
+    """
+    A prefilter looking for a single literal, with str.find (or bytes.find)
+    """
+
+    def __init__(self, literal, lead):
+        self.literal = literal
+        self.lead = lead
+
+    def candidate(self, input, pos, final=True):
+        """
+        Returns the first pos from pos on a match may start at, or -1 if there's none.
+        Unless final, input is expected to be followed by more, the literal possibly straddling both
+        """
+        i = input.find(self.literal, pos)
+        if i < 0:
+            if final:
+                return -1
+            # the literal may start in the last chars of the input
+            i = len(input) - len(self.literal) + 1
+        if self.lead is None:
+            return pos
+        return max(pos, i - self.lead)
+
+
+class AhoCorasick:
+    """
+    A prefilter looking for any of a set of literals at once, with an Aho-Corasick automaton
+
+    The automaton is a trie of the literals, where each node links to the node of
+    its longest proper suffix that's in the trie, to fall back on when the next char
+    doesn't extend it. Every char is looked at once, however many literals there are
+    """
+
+    def __init__(self, literals, lead):
+        self.lead = lead
+        self.max_len = max(map(len, literals))
+        # node -> char -> node, the root being node 0
+        self.goto = [{}]
+        # node -> node of its longest proper suffix
+        self.fail = [0]
+        # node -> length of the longest literal ending at the node, 0 if none
+        self.longest = [0]
+        for literal in literals:
+            node = 0
+            for c in literal:
+                nxt = self.goto[node].get(c)
+                if nxt is None:
+                    nxt = self.goto[node][c] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.longest.append(0)
+                node = nxt
+            self.longest[node] = max(self.longest[node], len(literal))
+
+        # link nodes breadth-first, so that shorter suffixes are linked first
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for c, nxt in self.goto[node].items():
+                fail = self.fail[node]
+                while fail and c not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[nxt] = self.goto[fail].get(c, 0)
+                self.longest[nxt] = max(
+                    self.longest[nxt], self.longest[self.fail[nxt]])
+                queue.append(nxt)
+
+    def candidate(self, input, pos, final=True):
+        """
+        Returns the first pos from pos on a match may start at, or -1 if there's none.
+        Unless final, input is expected to be followed by more, the literals possibly straddling both
+        """
+        goto = self.goto
+        fail = self.fail
+        longest = self.longest
+        # earliest start of a literal found so far
+        best = -1
+        node = 0
+        for i in range(pos, len(input)):
+            c = input[i]
+            while node and c not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(c, 0)
+            if longest[node]:
+                start = i + 1 - longest[node]
+                if best < 0 or start < best:
+                    best = start
+            # literals ending after the next char start after best
+            if best >= 0 and i + 2 - self.max_len >= best:
+                break
+        if not final:
+            # a literal may start in the last chars of the input, before best, and end in what follows
+            tail = len(input) - self.max_len + 1
+            best = tail if best < 0 else min(best, tail)
+        elif best < 0:
+            return -1
+        if self.lead is None:
+            return pos
+        return max(pos, best - self.lead)
@@ -0,0 +1,511 @@
+
+from charset import CharSet
+from guards import Anchor, Lookaround
+import codegen
+import dfa
+import utf8
+import vectorized
+
+# byte ranges up to this size are stored as direct transitions rather than predicates (see Program.to_bytes)
+_MAX_BYTE_LOOKUPS = 4
+# version of the data Program.to_data returns, bumped whenever it changes
+DATA_VERSION = 1
+
+
+class State:
+    """
+    A state of a compiled automaton
+    """
+    __slots__ = ("chars", "preds", "eps", "guards", "closure", "gates")
+
+    def __init__(self, chars, preds, eps, guards):
+        # transitions on input, char -> tuple of target state ids
+        self.chars = chars
+        # transitions taken when a predicate is satisfied, tuple of (pred, target state id)
+        self.preds = preds
+        # targets of empty transitions
+        self.eps = eps
+        # conditions to be checked before entering the state
+        self.guards = guards
+        # states reachable through empty transitions without entering a guarded state,
+        # including this one (see Program.resolve_et)
+        self.closure = None
+        # guarded states reachable through empty transitions from the closure
+        self.gates = None
+
+
+class Program:
+    """
+    A compiled, integer-numbered NFA (see builder.Builder.freeze)
+
+    States are numbered densely from 0, with the start and final states at fixed ids,
+    and stored in a flat list, so that running the automaton only hashes small ints.
+    The state of each run is kept in a Matcher
+    """
+
+    START = 0  # start state
+    END = 1    # final state
+
+    def __init__(self, states):
+        # list of State, indexed by state id
+        self.states = states
+        self.has_guards = any(st.guards for st in states)
+        for i, st in enumerate(states):
+            st.closure, st.gates = self._close(i)
+        # the start state's closure, if it doesn't depend on guards
+        start = states[Program.START]
+        if start.guards or start.gates:
+            self.start_closure = None
+        else:
+            self.start_closure = start.closure
+        # tagged states, e.g the final states of the patterns of a set (see builder.Builder.tagged_union)
+        self.tags = ()
+        self.dfa_budget = dfa.DEFAULT_BUDGET
+        self._dfa = None
+        # functions generated for this program (see codegen.py), False if it can't be compiled
+        self._generated = None
+        # dense DFA table of this program (see vectorized.py), False if it can't be built
+        self._table = None
+        # minimal DFAs of this program (see dfa.minimal), by anchored, False if they can't be built
+        self._minimal = {}
+
+    def to_data(self):
+        """
+        Returns the program as plain data (nested tuples and dicts of ints, strs and bools),
+        e.g to be marshalled, see from_data
+
+        Predicates and guards are stored as descriptors: the ranges of char and byte sets,
+        the kind of anchors and, for lookarounds, their direction and their own program's data
+        """
+        states = tuple((st.chars, tuple(_pred_to_data(pred) + (to,) for pred, to in st.preds),
+                        st.eps, tuple(map(_guard_to_data, st.guards)))
+                       for st in self.states)
+        return (DATA_VERSION, states, self.tags, self.dfa_budget)
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Returns the program the data was returned for by to_data
+        """
+        version, states, tags, dfa_budget = data
+        if version != DATA_VERSION:
+            raise ValueError(f"unsupported program data version {version}")
+        # predicates are shared between states as often as not, so they're built once
+        sets = {}
+        res = cls([State(dict(chars), tuple((_pred_from_data(kind, ranges, sets), to) for kind, ranges, to in preds),
+                         tuple(eps), tuple(map(_guard_from_data, guards)))
+                   for chars, preds, eps, guards in states])
+        res.tags = tuple(tags)
+        res.dfa_budget = dfa_budget
+        return res
+
+    def __reduce__(self):
+        # pickled as data, without the lazy DFA's cache
+        return (Program.from_data, (self.to_data(),))
+
+    def to_bytes(self, reverse=False):
+        """
+        Returns a copy of the program running over the UTF-8 encoding of its input,
+        i.e over bytes instead of chars
+
+        Each char transition becomes a chain of byte transitions through new states,
+        chains leaving the same state sharing their common prefix.
+        If reverse, the program is meant to run over reversed input, so chains are reversed too
+        """
+        states = [State({}, [], st.eps, tuple(_guard_to_bytes(cond, reverse) for cond in st.guards))
+                  for st in self.states]
+        for i, st in enumerate(self.states):
+            # byte range sequences leaving the state, as (sequence, target)
+            seqs = []
+            for c, targets in st.chars.items():
+                try:
+                    seq = [(b, b) for b in c.encode("utf-8")]
+                except UnicodeEncodeError:
+                    # surrogates can't be encoded
+                    continue
+                seqs.extend((seq, to) for to in targets)
+            for pred, to in st.preds:
+                if not isinstance(pred, CharSet):
+                    raise ValueError("only char set predicates can be encoded")
+                seqs.extend((seq, to)
+                            for seq in utf8.sequences(pred.ranges))
+
+            # build the chains as a trie rooted at the state
+            # state -> target -> byte ranges
+            edges = {}
+            children = {}
+            for seq, to in seqs:
+                if reverse:
+                    seq = seq[::-1]
+                cur = i
+                for r in seq[:-1]:
+                    child = children.get((cur, r))
+                    if child is None:
+                        child = children[(cur, r)] = len(states)
+                        states.append(State({}, [], (), ()))
+                    edges.setdefault(cur, {}).setdefault(child, []).append(r)
+                    cur = child
+                edges.setdefault(cur, {}).setdefault(to, []).append(seq[-1])
+
+            for fr, targets in edges.items():
+                chars = states[fr].chars
+                for to, ranges in targets.items():
+                    ranges = sorted(set(ranges))
+                    if sum(hi - lo + 1 for lo, hi in ranges) <= _MAX_BYTE_LOOKUPS:
+                        # few bytes are looked up directly
+                        for lo, hi in ranges:
+                            for b in range(lo, hi + 1):
+                                chars[b] = chars.get(b, ()) + (to,)
+                    else:
+                        states[fr].preds.append((utf8.ByteSet(ranges), to))
+
+        for st in states:
+            st.chars = {b: tuple(sorted(set(targets)))
+                        for b, targets in st.chars.items()}
+            st.preds = tuple(st.preds)
+        res = Program(states)
+        res.dfa_budget = self.dfa_budget
+        res.tags = self.tags
+        # states sharing a char class each get their own chains, merged back by the optimization pass
+        # (imported here, as it imports this module)
+        from optimize import optimize
+        return optimize(res)
+
+    # returns the closure and gates of a state (see State)
+    def _close(self, state):
+        closure = {state}
+        gates = set()
+        stack = [state]
+        while stack:
+            for to in self.states[stack.pop()].eps:
+                if to in closure or to in gates:
+                    continue
+                if self.states[to].guards:
+                    # only known at runtime
+                    gates.add(to)
+                else:
+                    closure.add(to)
+                    stack.append(to)
+        return frozenset(closure), tuple(gates)
+
+    # check guards associated with the state, if any, against the flags of a run (see Matcher)
+    def check_guard(self, state, flags):
+        for cond in self.states[state].guards:
+            if not cond(flags):
+                return False
+        return True
+
+    # returns the lazy DFA running this program, or None if it can't be used
+    def get_dfa(self):
+        if self.has_guards:
+            # guards depend on the position in the input
+            return None
+        if self._dfa is None:
+            self._dfa = dfa.LazyDFA(self, self.dfa_budget)
+        elif self._dfa.failed:
+            return None
+        return self._dfa
+
+    # returns the functions generated for this program (see codegen.py), or None if it can't be compiled
+    def get_generated(self):
+        if self._generated is None:
+            self._generated = codegen.generate(self) or False
+        return self._generated or None
+
+    # returns the dense DFA table of this program (see vectorized.py), or None if it can't be built
+    def get_table(self):
+        if self._table is None:
+            self._table = vectorized.build(self) or False
+        return self._table or None
+
+    # returns the minimal DFA of this program (see dfa.minimal), or None if it can't be built
+    def get_minimal(self, anchored=True):
+        res = self._minimal.get(anchored)
+        if res is None:
+            res = self._minimal[anchored] = dfa.minimal(self, anchored) or False
+        return res or None
+
+    # returns True if the program runs over bytes (see to_bytes)
+    def is_binary(self):
+        for st in self.states:
+            for c in st.chars:
+                return isinstance(c, int)
+            for pred, _ in st.preds:
+                return isinstance(pred, utf8.ByteSet)
+        return False
+
+    # returns the states reached from states on input
+    # (flags can be left out if the program has no guards, as when called by the lazy DFA)
+    def _step(self, states, input, flags=None):
+        new_state = set()
+        for state in states:
+            st = self.states[state]
+            targets = st.chars.get(input)
+            if targets is not None:
+                for to_state in targets:
+                    if self.check_guard(to_state, flags):
+                        new_state.add(to_state)
+            for pred, to_state in st.preds:
+                if pred(input) and self.check_guard(to_state, flags):
+                    new_state.add(to_state)
+
+        return self.resolve_et(new_state, flags)
+
+    # non-deterministically follow empty transitions
+    # closures are precomputed, only guards are left to be checked
+    def resolve_et(self, state_list, flags=None):
+        visited = set()
+        stack = list(state_list)
+        while stack:
+            state = stack.pop()
+            if state in visited:
+                continue
+            st = self.states[state]
+            if st.guards and not self.check_guard(state, flags):
+                continue
+            visited |= st.closure
+            stack.extend(st.gates)
+        return visited
+
+    # Run automaton on input[start:end]
+    def process(self, input, start, end, debug=False, short_circuit=False):
+        return Matcher(self, input, start - 1).process(start, end, debug, short_circuit)
+
+    def scan(self, input):
+        """
+        Runs the program on an input and returns a list indicating, for each char, if a match ends right after it
+        """
+        return [end == 1 for end in self.match_ends(input)[1:]]
+
+    def match_ends(self, input):
+        """
+        Runs the program on an input, starting it anew at every pos,
+        and returns a bytearray flagging every pos (from 0 to len(input)) a match ends at
+        """
+        return Matcher(self, input).match_ends()
+
+    def match_tags(self, input):
+        """
+        Runs the program on an input, starting it anew at every pos,
+        and returns the set of indices (in self.tags) of the tagged states non-empty matches reach
+        """
+        return Matcher(self, input).match_tags()
+
+
+def new_flags(input, pos=-1):
+    """
+    Returns the flags of a run over input (see Matcher)
+    """
+    return {"input": input, "input_len": len(input), "pos": pos, "tables": {}}
+
+
+class Matcher:
+    """
+    The state of a single run of a Program over an input
+
+    Runs leave their Program untouched (but for the cache of its lazy DFA),
+    so that a Program can be run by many threads at once, each run having its own Matcher
+    """
+    __slots__ = ("prog", "flags", "state", "_dstate")
+
+    def __init__(self, prog, input, pos=-1):
+        self.prog = prog
+        # flags pertinent to the input being processed, read by guards: the input, its length,
+        # the pos of the last char consumed and the tables of lookarounds (see guards.Lookaround)
+        self.flags = new_flags(input, pos)
+        # the automaton's current state(s)
+        self.state = None
+        self._dstate = None
+        # set flags before calling reset as empty transitions may involve checking guards
+        self.reset()
+
+    def reset(self, input=None):
+        """
+        Reset the run to the program's initial state, over a new input if given
+
+        The flags are reused, so that a single Matcher can be run over many inputs in turn
+        """
+        if input is not None:
+            flags = self.flags
+            flags["input"] = input
+            flags["input_len"] = len(input)
+            flags["pos"] = -1
+            flags["tables"].clear()
+        lazy = self.prog.get_dfa()
+        if lazy is not None:
+            self._dstate = lazy.start
+            self.state = lazy.start.states
+        else:
+            self.state = self.prog.resolve_et({Program.START}, self.flags)
+
+    # invoke transition(s) if applicable
+    def transition(self, input):
+        lazy = self.prog.get_dfa()
+        if lazy is None:
+            self.state = self.prog._step(self.state, input, self.flags)
+            return
+        self._dstate = lazy.step(self._current_dstate(lazy), input)
+        self.state = self._dstate.states
+
+    # returns the DFA state matching the current state(s)
+    def _current_dstate(self, lazy):
+        d = self._dstate
+        if d is None or d.states is not self.state:
+            d = lazy.intern(self.state)
+        return d
+
+    # returns the current state(s) with the start state added back in
+    def _seeded(self):
+        prog = self.prog
+        # its closure can only be cached if it doesn't depend on guards
+        return self.state | (prog.start_closure or prog.resolve_et({Program.START}, self.flags))
+
+    # returns True if at least one state is accepted
+    def accepts(self):
+        return Program.END in self.state
+
+    # Run automaton on input[start:end], flags["pos"] being start - 1
+    def process(self, start, end, debug=False, short_circuit=False):
+        input = self.flags["input"]
+        if debug:
+            print("proc: input", input)
+        if short_circuit and self.accepts():
+            return True
+        for i in range(start, end):
+            self.flags["pos"] = i
+            self.transition(input[i])
+            if debug:
+                print("proc:", input[i], self.accepts(), self.state)
+            if not self.state:
+                # no active branches left
+                break
+            if short_circuit and self.accepts():
+                return True
+        return self.accepts()
+
+    # see Program.match_ends
+    def match_ends(self):
+        prog = self.prog
+        flags = self.flags
+        input = flags["input"]
+        input_len = flags["input_len"]
+        res = bytearray(input_len + 1)
+        res[0] = self.accepts()
+        for i in range(input_len):
+            flags["pos"] = i
+            lazy = prog.get_dfa()
+            if lazy is not None:
+                # no guards, so the start state(s) can be added back in from the cache
+                self._dstate = lazy.seed(
+                    lazy.step(self._current_dstate(lazy), input[i]))
+                self.state = self._dstate.states
+                res[i+1] = self._dstate.accepts
+                continue
+            self.transition(input[i])
+            # add the start state back in, after input[i] is consumed
+            self.state = self._seeded()
+            res[i+1] = self.accepts()
+        return res
+
+    # returns True if a non-empty match ends anywhere in the input, starting the program anew
+    # at every pos and stopping at the first match, or if the input is empty and matched
+    def is_match(self):
+        prog = self.prog
+        flags = self.flags
+        input = flags["input"]
+        if flags["input_len"] == 0:
+            return self.accepts()
+        lazy = prog.get_dfa()
+        if lazy is not None:
+            d = self._current_dstate(lazy)
+            step = lazy.step
+            seed = lazy.seed
+            found = False
+            for c in input:
+                # look the state up before adding the start state back in, so that empty matches don't count
+                d = step(d, c)
+                if d.accepts:
+                    found = True
+                    break
+                d = seed(d)
+            self._dstate = d
+            self.state = d.states
+            return found
+        for i in range(flags["input_len"]):
+            flags["pos"] = i
+            self.transition(input[i])
+            if self.accepts():
+                return True
+            self.state = self._seeded()
+        return False
+
+    # see Program.match_tags
+    def match_tags(self):
+        prog = self.prog
+        tags = prog.tags
+        flags = self.flags
+        input = flags["input"]
+        res = set()
+        for i in range(flags["input_len"]):
+            flags["pos"] = i
+            lazy = prog.get_dfa()
+            if lazy is not None:
+                # look the states up before adding the start state back in, so that empty matches don't count
+                d = lazy.step(self._current_dstate(lazy), input[i])
+                found = d.tags
+                if found is None:
+                    found = d.tags = frozenset(k for k, state in enumerate(tags)
+                                               if state in d.states)
+                self._dstate = lazy.seed(d)
+                self.state = self._dstate.states
+            else:
+                self.transition(input[i])
+                found = [k for k, state in enumerate(tags)
+                         if state in self.state]
+                self.state = self._seeded()
+            if found:
+                res.update(found)
+                if len(res) == len(tags):
+                    # every tag's been found
+                    break
+        return res
+
+
+# returns a guard checking the same condition over the UTF-8 encoded input
+def _guard_to_bytes(cond, reverse):
+    if isinstance(cond, Lookaround):
+        return cond.to_bytes(reverse)
+    # anchors work on both
+    return cond
+
+
+# returns the descriptor of a predicate, as (kind, ranges)
+def _pred_to_data(pred):
+    if isinstance(pred, CharSet):
+        return ("chars", pred.ranges)
+    if isinstance(pred, utf8.ByteSet):
+        return ("bytes", pred.ranges)
+    raise ValueError("only char and byte set predicates can be stored as data")
+
+
+def _pred_from_data(kind, ranges, sets):
+    pred = sets.get((kind, ranges))
+    if pred is None:
+        pred = sets[(kind, ranges)] = CharSet(ranges) if kind == "chars" else utf8.ByteSet(ranges)
+    return pred
+
+
+# returns the descriptor of a guard: ("anchor", kind) or ("lookaround", ahead, negate, program data)
+def _guard_to_data(cond):
+    if isinstance(cond, Anchor):
+        return ("anchor", cond.kind)
+    if isinstance(cond, Lookaround):
+        return ("lookaround", cond.ahead, cond.negate, cond.fa.to_data())
+    raise ValueError("only anchors and lookarounds can be stored as data")
+
+
+def _guard_from_data(data):
+    if data[0] == "anchor":
+        return Anchor(data[1])
+    _, ahead, negate, fa = data
+    return Lookaround(Program.from_data(fa), ahead, negate)
@@ -1,75 +1,591 @@
 from timeit import default_timer as timer
+from array import array
+from collections import OrderedDict, namedtuple
+from builder import Builder
+from stats import Stats, instrument
+import marshal
+import sys
+import threading
+import analysis
+import dfa
 import lexer
+import parallel
 import parser
+import pikevm
+import prefilter
+import program
 
 
 class Regex:
     """
     A regex class, for encapsulation
+
+    Compiled patterns aren't changed by matching, so they can be shared between threads
+
+    With binary=True, the pattern is compiled to match the UTF-8 encoding of its chars,
+    and inputs are bytes-like (bytes, bytearray or memoryview) rather than str
+
+    With codegen=True, patterns without guards are also compiled to a Python function (see codegen.py),
+    telling whether inputs have a match faster than the automaton can
+
+    With eager=True, patterns without guards are also compiled up front to minimal DFAs (see dfa.minimal),
+    run instead of the automaton to tell whether inputs match as a whole, or have a match (see dfa_size)
     """
 
-    def __init__(self, pattern):
-        # forward nfa looks for match end positions
-        self.fa = parser.parse(lexer.lex(pattern))
-        lexer.set_reverse(True)
-        # reverse nfa looks for match start positions
-        self.fa_rev = parser.parse(lexer.lex(pattern))
+    def __init__(self, pattern, dfa_budget=dfa.DEFAULT_BUDGET, binary=False, codegen=False, eager=False):
+        self.pattern = pattern
+        self.binary = binary
+        self.codegen = codegen
+        self.eager = eager
+        tree = lexer.lex(pattern)
+        self.fa = parser.compile(tree)
+        if binary:
+            self.fa = self.fa.to_bytes()
+        self.fa.dfa_budget = dfa_budget
+        # how far around a match guards may read, None if unbounded
+        self.reach = analysis.reach(tree)
+        # max length of a match, None if unbounded
+        self.max_len = analysis.max_len(tree)
+        # literals every match contains one of, and how far into the match they may start (see analysis.required_literals)
+        self.required = analysis.required_literals(tree)
+        if self.required is not None and binary:
+            literals, lead = self.required
+            # leads are counted in chars, up to 4 bytes each
+            self.required = (tuple(literal.encode("utf-8") for literal in literals), lead and lead * 4)
+        self._init_prefilter()
+        if eager:
+            self.fa.get_minimal(anchored=True)
+            self.fa.get_minimal(anchored=False)
 
-    def scan(self, input, debug=False):
+    # set up the prefilter, skipping inputs (or parts of them) without any of the required literals
+    def _init_prefilter(self):
+        self.prefilter = None
+        if self.required is not None:
+            self.prefilter = prefilter.of(*self.required)
+
+    def dumps(self):
         """
-        Scans the input for matches and returns a list of intervals of matching substrings
+        Returns the compiled pattern as bytes, loaded back by loads() without compiling it again
+        """
+        return _dumps(("Regex", self.pattern, self.binary, self.codegen, self.eager, self.fa.to_data(),
+                       self.reach, self.max_len, self.required))
 
-        Using a reverse NFA was inspired by 
-        https://github.com/BurntSushi/regex-automata/blob/e7bda549a0d49d79c631ded6f47846ad69aa8a3e/src/regex.rs#L14-L19
+    def save(self, path):
         """
-        if input == "" and self.fa.accepts() and self.fa_rev.accepts():
-            # match empty input
-            return [(0, 0)]
+        Saves the compiled pattern to a file, loaded back by load()
+        """
+        _save(self, path)
+
+    def __reduce__(self):
+        # pickled compiled, e.g when sent to worker processes
+        return (loads, (self.dumps(),))
+
+    def scan(self, input, debug=False, overlapped=True, stats=None):
+        """
+        Scans the input for matches and returns a list of intervals of matching substrings
 
-        # match start position(s)
-        start = self.fa_rev.scan(input[::-1])[::-1]
-        # match end position(s)
-        end = self.fa.scan(input)
+        By default every matching substring is returned, overlapping ones included.
+        With overlapped=False, only the non-overlapping leftmost-longest matches are returned.
+        If given a stats.Stats, the work done is counted into it (see stats.py, and set_stats_hook)
+        """
+        _check_input(input, self.binary)
+        hook = _stats_hook
+        if hook is not None and stats is None:
+            stats = Stats()
+        matches = self._scan(input, overlapped, stats)
+        if hook is not None:
+            hook(self, stats)
 
-        if debug:
+        if debug and not self.binary:
             # highlight matching substrings, if debug
             ustart = '\u001b[32;1m\033[4m'
             uend = '\u001b[0m\033[0m'
+            for i, j in matches:
+                print(input[:i] + ustart + input[i:j] + uend + input[j:])
+        return matches
+
+    # see scan
+    def _scan(self, input, overlapped, stats):
+        fa = self.fa if stats is None else instrument(self.fa, stats)
+        if len(input) == 0:
+            # match empty input
+            return [(0, 0)] if fa.process(input, 0, 0) else []
+        if self._rejects(input) or not self._may_match(input):
+            return []
+        if overlapped:
+            return pikevm.overlapping(fa, input, self._prefilter(input), stats=stats)
+        return pikevm.leftmost_longest(fa, input, self._prefilter(input), stats)
+
+    def scan_parallel(self, input, workers=None, overlapped=True, chunk_size=None):
+        """
+        Scans the input as scan does, split into chunks scanned in parallel by a pool of worker processes (see parallel.py)
+
+        workers defaults to the number of CPUs, chunk_size to a few chunks per worker
+        """
+        _check_input(input, self.binary)
+        return parallel.scan(self, input, workers, overlapped, chunk_size)
+
+    def search(self, input, stats=None):
+        """
+        Returns the first of the leftmost-longest matches in input, as a (start, end) interval, or None if there's none
+
+        If given a stats.Stats, the work done is counted into it, as for scan
+        """
+        _check_input(input, self.binary)
+        hook = _stats_hook
+        if hook is not None and stats is None:
+            stats = Stats()
+        res = self._search(input, stats)
+        if hook is not None:
+            hook(self, stats)
+        return res
+
+    # see search
+    def _search(self, input, stats):
+        fa = self.fa if stats is None else instrument(self.fa, stats)
+        if len(input) == 0:
+            return (0, 0) if fa.process(input, 0, 0) else None
+        if self._rejects(input) or not self._may_match(input):
+            return None
+        matches = pikevm.LeftmostLongest(
+            fa, prefilter=self._prefilter(input), stats=stats).feed(input, first=True)
+        return matches[0] if matches else None
+
+    def fullmatch(self, input):
+        """
+        Returns the interval of the whole input, (0, len(input)), if the pattern matches it as a whole, else None
+
+        Compiled with eager=True, this is a single pass of the pattern's minimal DFA over the input
+        """
+        _check_input(input, self.binary)
+        minimal = self.fa.get_minimal(anchored=True) if self.eager else None
+        if minimal is not None:
+            matched = minimal.fullmatch(input)
+        else:
+            matched = self.fa.process(input, 0, len(input))
+        return (0, len(input)) if matched else None
+
+    def dfa_size(self):
+        """
+        Returns the number of states and char classes of the minimal DFAs the pattern is run as if compiled
+        with eager=True, as {"fullmatch": (states, classes), "search": (states, classes)}
+        (see fullmatch and is_match_many), a DFA being None if it can't be built
+        (the pattern has guards, or the DFA would be too big, see dfa.MAX_STATES), or None if not eager
+        """
+        if not self.eager:
+            return None
+        res = {}
+        for name, anchored in (("fullmatch", True), ("search", False)):
+            minimal = self.fa.get_minimal(anchored)
+            res[name] = None if minimal is None else (len(minimal), minimal.num_classes)
+        return res
+
+    def is_match_many(self, inputs, workers=None):
+        """
+        Returns the indices of the inputs with a match (those search wouldn't return None for), as an array
+
+        Meant for many short inputs: the search is set up once for all of them, and inputs without
+        any of the required literals are skipped without running it. With workers > 1,
+        the inputs are split into batches matched in parallel by a pool of worker processes
+        """
+        res = array("q")
+        if workers is not None and workers > 1:
+            for offset, found in parallel.map_batches(self, "is_match_many", inputs, workers):
+                res.extend(k + offset for k in found)
+            return res
+        is_match = self._match_test()
+        for k, input in enumerate(inputs):
+            _check_input(input, self.binary)
+            if not self._rejects_any(input) and is_match(input):
+                res.append(k)
+        return res
+
+    def scan_many(self, inputs, overlapped=True, workers=None):
+        """
+        Scans each of the inputs as scan does, and returns the matches in all of them
+        as a single list of (input index, start, end), ordered by input index, start then end
 
-        matches = []
-
-        """if debug:
-            print(input)
-            print(start)
-            print(end)"""
-        # this returns all possible matching substrings
-        # to get the longest match, take the smallest starting pos and the largest ending pos and check if valid
-        for i in range(len(start)):
-            # iterate over start positions
-            if not start[i]:
+        Like is_match_many, the search is set up once for all inputs, and only inputs with a match get scanned
+        (if the pattern has no guards, a lazy DFA tells which do). With workers > 1,
+        the inputs are split into batches scanned in parallel by a pool of worker processes
+        """
+        res = []
+        if workers is not None and workers > 1:
+            for offset, found in parallel.map_batches(self, "scan_many", inputs, workers,
+                                                      overlapped=overlapped):
+                res.extend((k + offset, start, end) for k, start, end in found)
+            return res
+        # the DFA (or generated code) only pays off as a first pass if there are no guards
+        is_match = self._match_test() if not self.fa.has_guards else None
+        search = pikevm.LeftmostLongest(self.fa)
+        for k, input in enumerate(inputs):
+            _check_input(input, self.binary)
+            if len(input) == 0:
+                # match empty input
+                if self.fa.process(input, 0, 0):
+                    res.append((k, 0, 0))
                 continue
-            for j in range(i, len(start)):
-                # iterate over end positions
-                if not end[j]:
-                    continue
-                # confirm the match
-                # TODO: confirming the match is necessary for matches with
-                # consecutive start and end positions, but is it always necessary?
-                if not self.fa.process(input, i, j+1):
-                    continue
-                matches.append((i, j+1))
-                if debug:
-                    print(input[:i] + ustart +
-                          input[i:j+1] + uend + input[j+1:])
-        return matches
+            if self._rejects_any(input):
+                continue
+            if is_match is not None and not is_match(input):
+                continue
+            if overlapped:
+                pikevm.overlapping(self.fa, input, self._prefilter(input), res, (k,))
+            else:
+                search.reset()
+                search.prefilter = self._prefilter(input)
+                res.extend((k, start, end) for start, end in search.feed(input))
+        return res
+
+    def fullmatch_many(self, inputs):
+        """
+        Returns the inputs matched as a whole, as a list of (input index, 0, input length) like scan_many's
+
+        Meant for validating many inputs, e.g a column of a dataframe: if compiled with eager=True, the inputs
+        are all run at once through a dense table of the minimal DFA if NumPy is installed (see vectorized.py),
+        else one at a time through the minimal DFA (see fullmatch). Otherwise, they're run one at a time
+        through the automaton, as building the minimal DFA may not pay off
+        """
+        inputs = list(inputs)
+        for input in inputs:
+            _check_input(input, self.binary)
+        table = self.fa.get_table() if self.eager else None
+        minimal = self.fa.get_minimal(anchored=True) if self.eager else None
+        if table is not None:
+            matched = table.fullmatch(inputs)
+        elif minimal is not None:
+            matched = [k for k, input in enumerate(inputs) if minimal.fullmatch(input)]
+        else:
+            matched = []
+            matcher = program.Matcher(self.fa, "")
+            for k, input in enumerate(inputs):
+                matcher.reset(input)
+                if matcher.process(0, len(input)):
+                    matched.append(k)
+        return [(k, 0, len(inputs[k])) for k in matched]
+
+    # returns a function telling if an input has a match (see is_match_many),
+    # set up to be run over many inputs in turn
+    def _match_test(self):
+        compiled = self._compiled()
+        if compiled is not None:
+            return compiled.is_match
+        matcher = program.Matcher(self.fa, "")
+        # guards rule the DFA out, searches are run as search does then
+        search = pikevm.LeftmostLongest(self.fa) if self.fa.has_guards else None
+
+        def is_match(input):
+            if search is None or len(input) == 0:
+                matcher.reset(input)
+                return matcher.is_match()
+            search.reset()
+            search.prefilter = self._prefilter(input)
+            return bool(search.feed(input, first=True))
+        return is_match
+
+    # returns what the pattern is compiled to besides its automaton, telling if an input has a match:
+    # the functions generated for it if codegen=True, else its minimal DFA if eager=True (if they can be built)
+    def _compiled(self):
+        res = None
+        if self.codegen:
+            res = self.fa.get_generated()
+        if res is None and self.eager:
+            res = self.fa.get_minimal(anchored=False)
+        return res
+
+    # returns False if the generated code (or minimal DFA) tells the input has no match, or,
+    # if the pattern has no guards, the lazy DFA does (see scan_many): inputs without a match
+    # then take a DFA pass rather than a search
+    def _may_match(self, input):
+        compiled = self._compiled()
+        if compiled is not None:
+            return compiled.is_match(input)
+        if self.fa.get_dfa() is None:
+            # the pattern has guards, or the DFA gave up
+            return True
+        return program.Matcher(self.fa, input).is_match()
+
+    # returns True if the input can't match, as it doesn't contain any of the required literals
+    # (only checked up front if the prefilter can't skip, see _prefilter)
+    def _rejects(self, input):
+        return (self.prefilter is not None and self.prefilter.lead is None and
+                hasattr(input, "find") and self.prefilter.candidate(input, 0) < 0)
+
+    # like _rejects, whether or not the prefilter can skip
+    def _rejects_any(self, input):
+        return (self.prefilter is not None and hasattr(input, "find") and
+                self.prefilter.candidate(input, 0) < 0)
+
+    # returns the prefilter to search the input with, if it can skip over it
+    def _prefilter(self, input):
+        # memoryviews can't be searched for literals
+        if self.prefilter is None or self.prefilter.lead is None or not hasattr(input, "find"):
+            return None
+        return self.prefilter
+
+    def finditer_stream(self, fileobj, chunk_size=1 << 16):
+        """
+        Reads a file-like object (opened in text mode, or binary mode if binary) chunk by chunk and yields the
+        non-overlapping leftmost-longest matches found in it, as (start, end, text) tuples
+        with start and end being offsets in the whole stream
+
+        Only the input still needed by the search is kept between chunks,
+        i.e from the start of the earliest match in progress, plus as much context
+        as anchors and lookarounds need. Patterns with lookarounds of unbounded length
+        need the whole stream, so it's read in at once for them
+        """
+        behind, ahead = self.reach
+        if behind is None or ahead is None:
+            input = fileobj.read()
+            for start, end in self.scan(input, overlapped=False):
+                yield (start, end, input[start:end])
+            return
+
+        # buffer holds the input from pos offset on
+        buffer = b"" if self.binary else ""
+        search = pikevm.LeftmostLongest(
+            self.fa, behind, ahead, self._prefilter(buffer))
+        offset = 0
+        while True:
+            chunk = fileobj.read(chunk_size)
+            final = not chunk
+            if final and offset == 0 and not buffer:
+                # the stream is empty, matched as empty input (see scan)
+                if self.fa.process(buffer, 0, 0):
+                    yield (0, 0, buffer)
+                return
+            buffer += chunk
+            for start, end in search.feed(buffer, offset, final):
+                yield (start, end, buffer[start-offset:end-offset])
+            if final:
+                return
+            keep = search.keep_from()
+            buffer = buffer[keep-offset:]
+            offset = keep
+
+
+class RegexSet:
+    """
+    A set of patterns, compiled into a single automaton so that they're all matched in one pass
+
+    The final state of each pattern is tagged with its index in the set,
+    so that matches tell which pattern they're of
+    """
+
+    def __init__(self, patterns, dfa_budget=None, binary=False):
+        self.patterns = tuple(patterns)
+        if dfa_budget is None:
+            # DFA states grow with the number of patterns, so does the default budget (up to 64MB)
+            dfa_budget = min(dfa.DEFAULT_BUDGET * max(len(self.patterns), 1), 1 << 26)
+        self.binary = binary
+        # the patterns are all built in the same arena
+        b = Builder()
+        fa, tags = b.tagged_union(
+            [parser.parse(lexer.lex(pattern), b) for pattern in self.patterns])
+        self.fa = b.freeze(fa, tags)
+        if binary:
+            self.fa = self.fa.to_bytes()
+        self.fa.dfa_budget = dfa_budget
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def dumps(self):
+        """
+        Returns the compiled set as bytes, loaded back by loads() without compiling it again
+        """
+        return _dumps(("RegexSet", self.patterns, self.binary, self.fa.to_data()))
+
+    def save(self, path):
+        """
+        Saves the compiled set to a file, loaded back by load()
+        """
+        _save(self, path)
+
+    def __reduce__(self):
+        return (loads, (self.dumps(),))
+
+    def matches(self, input):
+        """
+        Returns the sorted indices of the patterns matching somewhere in the input
+        """
+        _check_input(input, self.binary)
+        if len(input) == 0:
+            # match empty input
+            state = program.Matcher(self.fa, input).state
+            return [k for k, tag in enumerate(self.fa.tags) if tag in state]
+        return sorted(self.fa.match_tags(input))
+
+    def scan(self, input):
+        """
+        Scans the input for matches of any of the patterns and returns a list of (pattern index, start, end),
+        ordered by start, end then pattern index
+
+        Like Regex.scan, every matching substring is returned, overlapping ones included
+        """
+        _check_input(input, self.binary)
+        if len(input) == 0:
+            return [(k, 0, 0) for k in self.matches(input)]
+        return pikevm.overlapping_tagged(self.fa, input)
+
+
+# raise if the input's type doesn't match the mode the pattern was compiled in
+def _check_input(input, binary):
+    if isinstance(input, str) == binary:
+        expected = "a bytes-like object" if binary else "a str"
+        raise TypeError(f"expected {expected}, got {type(input).__name__}")
+
+
+# called with (Regex, Stats) after every scan and search, see set_stats_hook
+_stats_hook = None
+
+
+def set_stats_hook(hook):
+    """
+    Set a function to be called with (Regex, stats.Stats) after every scan or search,
+    each being counted for it, e.g to find out which patterns are slow on production inputs.
+    None (the default) stops counting
+    """
+    global _stats_hook
+    _stats_hook = hook
+
+
+# header of compiled patterns and sets saved as bytes, followed by their data, marshalled
+# (its last byte is the version of the data, bumped whenever it changes)
+_MAGIC = b"RGX\x02"
+
+
+def _dumps(data):
+    return _MAGIC + marshal.dumps(data)
+
+
+def _save(compiled, path):
+    with open(path, "wb") as f:
+        f.write(compiled.dumps())
+
+
+def loads(data):
+    """
+    Returns the Regex or RegexSet compiled into bytes by its dumps method
+
+    The bytes are marshalled data, only meant to be loaded by the same version of Python
+    (and never from an untrusted source)
+    """
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError("not a compiled pattern")
+    data = marshal.loads(data[len(_MAGIC):])
+    kind = data[0]
+    if kind == "Regex":
+        _, pattern, binary, codegen, eager, fa, reach, max_len, required = data
+        res = Regex.__new__(Regex)
+        res.pattern = pattern
+        res.binary = binary
+        res.codegen = codegen
+        res.eager = eager
+        res.fa = program.Program.from_data(fa)
+        res.reach = reach
+        res.max_len = max_len
+        res.required = required
+        res._init_prefilter()
+        return res
+    if kind == "RegexSet":
+        _, patterns, binary, fa = data
+        res = RegexSet.__new__(RegexSet)
+        res.patterns = patterns
+        res.binary = binary
+        res.fa = program.Program.from_data(fa)
+        return res
+    raise ValueError(f"unknown compiled kind {kind}")
+
+
+def load(path):
+    """
+    Returns the Regex or RegexSet saved to a file by its save method
+    """
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "size", "maxsize"])
+
+# compiled patterns, least recently used first
+_cache = OrderedDict()
+_cache_maxsize = 256
+_cache_hits = 0
+_cache_misses = 0
+_cache_lock = threading.Lock()
+
+
+def compile(pattern, **options):
+    """
+    Returns a Regex for the pattern, reusing the one last compiled with the same options if it's still cached
+
+    options are passed on to Regex
+    """
+    global _cache_hits, _cache_misses
+    key = (pattern, tuple(sorted(options.items())))
+    with _cache_lock:
+        res = _cache.get(key)
+        if res is not None:
+            _cache_hits += 1
+            _cache.move_to_end(key)
+            return res
+        _cache_misses += 1
+    # compile outside of the lock, a pattern compiled twice concurrently is only wasted work
+    res = Regex(pattern, **options)
+    with _cache_lock:
+        _cache[key] = res
+        while len(_cache) > _cache_maxsize:
+            _cache.popitem(last=False)
+    return res
+
+
+def set_cache_size(maxsize):
+    """
+    Set the max number of compiled patterns kept by compile(), evicting the least recently used ones if need be
+    """
+    global _cache_maxsize
+    if maxsize < 0:
+        raise ValueError("cache size must be >= 0")
+    with _cache_lock:
+        _cache_maxsize = maxsize
+        while len(_cache) > _cache_maxsize:
+            _cache.popitem(last=False)
+
+
+def cache_info():
+    """
+    Returns the hit/miss stats and size of compile()'s cache
+    """
+    with _cache_lock:
+        return CacheInfo(_cache_hits, _cache_misses, len(_cache), _cache_maxsize)
+
+
+def purge():
+    """
+    Empty compile()'s cache and reset its stats
+    """
+    global _cache_hits, _cache_misses
+    with _cache_lock:
+        _cache.clear()
+        _cache_hits = _cache_misses = 0
+
+
+# pattern the REPL below falls back on, showcasing most of the syntax (also benchmarked, see bench.py)
+DEFAULT_PATTERN = r"^\[{3,}\??[hc2-4g-\x707-9]{,3}((a$|t)*)(gg|wp|lol)?(?<=wp|lol)a(?=he{2,3}llo)(he+llo$)*|^(\s*.\++\s*)+$|^(\u1f60B|எழுத்து$)*|((abc|def)*(?<!^def)ghi)|(abc(?=def$)(ghi|def$|lol)*)+|([\+\-]?(?=\d*[.eE])([0-9]?\.[0-9]+|\.[0-9]+)([eE][\+\-]?[0-9]+)?)"
+# fp pattern: (\+|-)?([0-9]+\.?[0-9]*|\.[0-9]+)([eE](\+|-)?[0-9]+)?
+# fp pattern (no integers): [\+\-]?(?=\d*[.eE])([0-9]?\.[0-9]+|\.[0-9]+)([eE][\+\-]?[0-9]+)?
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        # python regex.py PATTERN [FILE...], see grep.py
+        import grep
+        sys.exit(grep.main())
+
     pattern = input("Enter pattern: ")
     if pattern == "":
-        pattern = r"^\[{3,}\??[hc2-4g-\x707-9]{,3}((a$|t)*)(gg|wp|lol)?(?<=wp|lol)a(?=he{2,3}llo)(he+llo$)*|^(\s*.\++\s*)+$|^(\u1f60B|எழுத்து$)*|((abc|def)*(?<!^def)ghi)|(abc(?=def$)(ghi|def$|lol)*)+|([\+\-]?(?=\d*[.eE])([0-9]?\.[0-9]+|\.[0-9]+)([eE][\+\-]?[0-9]+)?)"
-        # fp pattern: (\+|-)?([0-9]+\.?[0-9]*|\.[0-9]+)([eE](\+|-)?[0-9]+)?
-        # fp pattern (no integers): [\+\-]?(?=\d*[.eE])([0-9]?\.[0-9]+|\.[0-9]+)([eE][\+\-]?[0-9]+)?
+        pattern = DEFAULT_PATTERN
         print("using def. pattern", pattern)
     reg = Regex(pattern)
 
@@ -0,0 +1,115 @@
+
+"""
+Instrumentation of the matching runtime, for finding out why a pattern is slow
+
+Runs only count when given a Stats object (see Regex.scan), in which case they run
+over an instrumented copy of the program (see instrument), whose predicates, guards and
+closures count their use. Uninstrumented runs are left as they are, but for a check per char
+"""
+from guards import Lookaround
+import program
+
+
+class Stats:
+    """
+    Counters of the work done by one or more runs
+    """
+    __slots__ = ("chars", "active_max", "active_total", "eps_states", "predicate_calls",
+                 "guard_calls", "lookaround_runs", "candidates")
+
+    def __init__(self):
+        # chars the threads were stepped over
+        self.chars = 0
+        # max and total (for the mean) number of threads stepped over a char
+        self.active_max = 0
+        self.active_total = 0
+        # states added through their closures (see program.State), i.e entered through empty transitions
+        self.eps_states = 0
+        # calls to char class predicates
+        self.predicate_calls = 0
+        # guard checks, and runs of lookarounds over the input (see guards.Lookaround)
+        self.guard_calls = 0
+        self.lookaround_runs = 0
+        # (start, end) pairs found to match, including those a leftmost-longest search drops for a better one
+        self.candidates = 0
+
+    @property
+    def active_mean(self):
+        return self.active_total / self.chars if self.chars else 0.0
+
+    # count a step of the given number of threads over a char
+    def step(self, active):
+        self.chars += 1
+        self.active_total += active
+        if active > self.active_max:
+            self.active_max = active
+
+    def as_dict(self):
+        """
+        Returns the counters by name, with the mean number of active threads
+        """
+        res = {name: getattr(self, name) for name in Stats.__slots__}
+        res["active_mean"] = self.active_mean
+        return res
+
+    def __repr__(self):
+        return "Stats(" + ", ".join(f"{name}={value}" for name, value in self.as_dict().items()) + ")"
+
+
+def instrument(prog, stats):
+    """
+    Returns a copy of the program counting its predicate calls, guard checks and closures into stats
+    """
+    states = []
+    for st in prog.states:
+        copy = program.State(st.chars, tuple((_CountedPred(pred, stats), to) for pred, to in st.preds),
+                             st.eps, tuple(_CountedGuard(cond, stats) for cond in st.guards))
+        copy.closure = _CountedClosure(st.closure, stats)
+        copy.gates = st.gates
+        states.append(copy)
+    res = program.Program.__new__(program.Program)
+    res.__dict__.update(prog.__dict__)
+    res.states = states
+    # caches are per program
+    res._dfa = res._generated = res._table = None
+    res._minimal = {}
+    return res
+
+
+class _CountedPred:
+    __slots__ = ("pred", "stats")
+
+    def __init__(self, pred, stats):
+        self.pred = pred
+        self.stats = stats
+
+    def __call__(self, c):
+        self.stats.predicate_calls += 1
+        return self.pred(c)
+
+
+class _CountedGuard:
+    __slots__ = ("cond", "stats")
+
+    def __init__(self, cond, stats):
+        self.cond = cond
+        self.stats = stats
+
+    def __call__(self, f):
+        stats = self.stats
+        stats.guard_calls += 1
+        if isinstance(self.cond, Lookaround) and self.cond not in f["tables"]:
+            stats.lookaround_runs += 1
+        return self.cond(f)
+
+
+# a closure counting the states it's iterated over, i.e entered through empty transitions
+class _CountedClosure(frozenset):
+    def __new__(cls, states, stats):
+        res = super().__new__(cls, states)
+        res.stats = stats
+        return res
+
+    def __iter__(self):
+        self.stats.eps_states += len(self)
+        return super().__iter__()
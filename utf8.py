@@ -0,0 +1,79 @@
+
+"""
+UTF-8 encoding of char sets, for running automata over bytes
+
+A range of codepoints is split into sequences of byte ranges, such that
+the UTF-8 encodings of the codepoints are exactly the byte strings matched by the sequences
+"""
+
+# last codepoint of each encoded length
+_LENGTH_ENDS = (0x7F, 0x7FF, 0xFFFF, 0x10FFFF)
+# surrogates have no UTF-8 encoding
+_SURROGATES = (0xD800, 0xDFFF)
+
+
+class ByteSet:
+    """
+    A set of bytes, stored as a bitmap
+
+    Instances are callable, so they can be used as predicates on the ints bytes are indexed as
+    """
+    __slots__ = ("ranges", "_bitmap")
+
+    def __init__(self, ranges):
+        # tuple of inclusive (lo, hi) byte ranges
+        self.ranges = tuple(ranges)
+        bitmap = bytearray(256)
+        for lo, hi in self.ranges:
+            bitmap[lo:hi+1] = b"\x01" * (hi - lo + 1)
+        self._bitmap = bytes(bitmap)
+
+    def __call__(self, x):
+        return self._bitmap[x] == 1
+
+    def __eq__(self, rhs):
+        return isinstance(rhs, ByteSet) and self.ranges == rhs.ranges
+
+    def __hash__(self):
+        return hash(self.ranges)
+
+    def __repr__(self):
+        return "ByteSet(" + repr(self.ranges) + ")"
+
+
+def sequences(ranges):
+    """
+    Yields the byte range sequences, as lists of inclusive (lo, hi) byte ranges, encoding the codepoint ranges
+    """
+    for lo, hi in ranges:
+        # surrogates are skipped
+        for lo, hi in ((lo, min(hi, _SURROGATES[0] - 1)), (max(lo, _SURROGATES[1] + 1), hi)):
+            # split on the boundaries between encoded lengths
+            start = lo
+            for end in _LENGTH_ENDS:
+                if start > hi:
+                    break
+                if start <= end:
+                    yield from _split(start, min(hi, end))
+                    start = end + 1
+
+
+# yields the sequences for a range of codepoints of the same encoded length
+def _split(lo, hi):
+    if lo > hi:
+        return
+    n = len(chr(lo).encode("utf-8"))
+    for i in range(1, n):
+        # mask of the bits in the last i bytes
+        m = (1 << (6 * i)) - 1
+        if lo & ~m != hi & ~m:
+            # split so that the last i bytes of both halves span their whole range
+            if lo & m != 0:
+                yield from _split(lo, lo | m)
+                yield from _split((lo | m) + 1, hi)
+                return
+            if hi & m != m:
+                yield from _split(lo, (hi & ~m) - 1)
+                yield from _split(hi & ~m, hi)
+                return
+    yield list(zip(chr(lo).encode("utf-8"), chr(hi).encode("utf-8")))
@@ -0,0 +1,97 @@
+
+"""
+Vectorized DFA execution over batches of inputs, with NumPy
+
+A program without guards is run as its minimal anchored DFA (see dfa.minimal), stored as a dense
+table of uint32 state ids indexed by state and char class. Inputs are then run all at once,
+a column of chars at a time, each step being a single fancy-indexing lookup of the states
+of every input still running.
+
+NumPy is optional, and only imported when a table is first built
+"""
+# max number of inputs run at once, bounding the memory taken by their char classes
+_BATCH_SIZE = 1 << 14
+
+
+# returns the numpy module, or None if it isn't installed
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def build(prog):
+    """
+    Returns the Table of a program, or None if it can't be built:
+    if NumPy isn't installed or the program's minimal DFA can't be (see dfa.minimal)
+    """
+    numpy = _numpy()
+    if numpy is None:
+        return None
+    minimal = prog.get_minimal(anchored=True)
+    if minimal is None:
+        return None
+    return Table(numpy, minimal)
+
+
+class Table:
+    """
+    A dense DFA transition table, over an alphabet compressed into classes of chars
+    """
+
+    def __init__(self, numpy, minimal):
+        self.numpy = numpy
+        # sorted codepoints (or bytes) classes start or end at, and the class of each interval
+        # (see dfa.MinimalDFA)
+        self.points = numpy.array(minimal.points, dtype=numpy.uint32)
+        self.class_map = numpy.array(minimal.class_map, dtype=numpy.uint32)
+        # array of shape (states, classes), state 0 being dead
+        self.table = numpy.array(minimal.rows, dtype=numpy.uint32)
+        self.start = minimal.start
+        # bool array, True for accepting states
+        self.accepts = numpy.array(minimal.accepts, dtype=bool)
+        self.binary = minimal.binary
+        if self.binary:
+            # bytes are mapped to their class directly
+            self.byte_classes = self.class_map[numpy.searchsorted(
+                self.points, numpy.arange(256, dtype=numpy.uint32), side="right")]
+
+    def fullmatch(self, inputs):
+        """
+        Returns the indices of the inputs the DFA accepts as a whole, in order
+        """
+        numpy = self.numpy
+        lens = numpy.array([len(input) for input in inputs], dtype=numpy.int64)
+        # longest first, so that the inputs still running at each column are a prefix of the batch
+        order = numpy.argsort(-lens, kind="stable")
+        matched = numpy.zeros(len(inputs), dtype=bool)
+        for first in range(0, len(inputs), _BATCH_SIZE):
+            batch = order[first:first + _BATCH_SIZE]
+            matched[batch] = self._run([inputs[k] for k in batch], lens[batch])
+        return numpy.flatnonzero(matched).tolist()
+
+    # returns a bool array telling which of the inputs, sorted by decreasing length, are accepted
+    def _run(self, inputs, lens):
+        numpy = self.numpy
+        if self.binary:
+            # inputs are padded with zeros to the longest one
+            chars = numpy.array([bytes(input) for input in inputs], dtype=bytes)
+            chars = chars.view(numpy.uint8).reshape(len(inputs), -1)
+            classes = self.byte_classes[chars]
+        else:
+            chars = numpy.array(inputs, dtype=str)
+            chars = chars.view(numpy.uint32).reshape(len(inputs), -1)
+            classes = self.class_map[numpy.searchsorted(self.points, chars, side="right")]
+        # number of inputs longer than each column
+        running = numpy.searchsorted(-lens, -numpy.arange(int(lens[0]) if len(lens) else 0), side="left")
+        table = self.table
+        state = numpy.full(len(inputs), self.start, dtype=numpy.uint32)
+        for col, n in enumerate(running):
+            state[:n] = table[state[:n], classes[:n, col]]
+            if not state[:n].any():
+                # every input still running is dead
+                break
+        return self.accepts[state]
+